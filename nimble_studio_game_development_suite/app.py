@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Synthesizes every application of the suite into a single CDK App.
+
+All stacks share one process, so they share one jsii runtime and one discovery
+pass of the studio. A subset of the stacks can be selected with the 'stacks'
+context value or the CDK_SUITE_STACKS environment variable, e.g.
+
+    cdk synth -c stacks=perforce_server,build_farm
+"""
+
+import os
+import sys
+from pathlib import Path
+
+from aws_cdk import App, Environment
+
+SUITE_PATH = Path(__file__).parent.absolute()
+
+# Each application imports its stacks relative to its own folder
+for app_folder in (
+    "nimble_studio_perforce_server",
+    "nimble_studio_build_farm",
+    "nimble_studio_build_pipeline",
+    "nimble_studio_license_server",
+):
+    sys.path.append(str(SUITE_PATH.joinpath(app_folder)))
+sys.path.append(str(SUITE_PATH))
+
+from utils.discovery_snapshot import snapshot_context
+
+SUITE_STACKS_ENV_VAR = "CDK_SUITE_STACKS"
+SUITE_STACKS_CONTEXT_KEY = "stacks"
+
+# Listed in deployment order
+SUITE_STACKS = (
+    "perforce_server",
+    "build_farm",
+    "build_pipeline",
+    "license_server",
+)
+
+
+def get_selected_stacks(app: App):
+    selection = app.node.try_get_context(SUITE_STACKS_CONTEXT_KEY) or os.getenv(
+        SUITE_STACKS_ENV_VAR
+    )
+    if not selection:
+        return list(SUITE_STACKS)
+
+    selected = [name.strip() for name in selection.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in SUITE_STACKS]
+    if unknown:
+        print(
+            f"ERROR: Unknown stacks {', '.join(unknown)}, expected any of {', '.join(SUITE_STACKS)}"
+        )
+        sys.exit(1)
+    return [name for name in SUITE_STACKS if name in selected]
+
+
+def create_stack(app: App, name: str, environment: Environment):
+    # Stacks are imported on demand, so unselected applications cost nothing
+    if name == "perforce_server":
+        from nimble_studio_perforce_server_stacks.nimble_studio_perforce_server_stack import (
+            NimbleStudioPerforceServerStack,
+        )
+
+        return NimbleStudioPerforceServerStack(
+            app,
+            "NimbleStudioPerforceServerStack",
+            description="A stack created for running a Perforce Server on AWS with Nimble Studio",
+        )
+
+    if name == "build_farm":
+        from nimblestudio.constructs.build_farm import NimbleStudioBuildFarmStack
+
+        return NimbleStudioBuildFarmStack(app, "NimbleStudioBuildFarm", env=environment)
+
+    if name == "build_pipeline":
+        from nimble_studio_build_pipeline_stacks.nimble_studio_build_pipeline_stack import (
+            NimbleStudioBuildPipelineStack,
+        )
+
+        return NimbleStudioBuildPipelineStack(
+            app, "NimbleStudioBuildPipelineStack", env=environment
+        )
+
+    from nimble_studio_license_server_stacks.nimble_studio_license_server_main_instance_stack import (
+        NimbleStudioLicenseServerMainInstanceStack,
+    )
+
+    return NimbleStudioLicenseServerMainInstanceStack(
+        app,
+        "NimbleStudioLicenseServerStack",
+        description="A stack created for running a License Server on AWS with Nimble Studio",
+    )
+
+
+# When replaying a discovery snapshot, its recorded context lookups are fed back
+# into the App so that synthesis doesn't need to reach AWS
+app = App(context=snapshot_context())
+
+environment = Environment(
+    account=os.getenv("CDK_DEFAULT_ACCOUNT"), region=os.getenv("CDK_DEFAULT_REGION")
+)
+
+# Each stack depends on the ones before it, so 'cdk deploy --all' follows the
+# deployment order of the suite
+previous_stack = None
+for stack_name in get_selected_stacks(app):
+    stack = create_stack(app, stack_name, environment)
+    if previous_stack is not None:
+        stack.add_dependency(previous_stack)
+    previous_stack = stack
+
+app.synth()
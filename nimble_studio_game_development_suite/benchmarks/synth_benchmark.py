@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Synth performance benchmark for the CDK applications in this suite.
+
+Each application's app.py is run in its own interpreter against a stubbed botocore:
+every AWS call made through utils.aws_clients is answered from
+fixtures/discovery_responses.json after an injected latency. For each application we
+report wall-clock time, AWS calls per service, peak memory (of the Python process and
+of the jsii node process it drives) and construct count. AWS calls and constructs must
+not grow from synth_baseline.json; time and memory are compared to it for information
+only, since they depend on the machine.
+
+Usage:
+    python benchmarks/synth_benchmark.py                    # run and compare
+    python benchmarks/synth_benchmark.py --update-baseline  # run and store a new baseline
+    python benchmarks/synth_benchmark.py --check-snapshots  # also check snapshot replays
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List
+
+BENCHMARKS_PATH = Path(__file__).parent.absolute()
+SUITE_PATH = BENCHMARKS_PATH.parent
+FIXTURES_PATH = BENCHMARKS_PATH.joinpath("fixtures", "discovery_responses.json")
+BASELINE_PATH = BENCHMARKS_PATH.joinpath("synth_baseline.json")
+
+APPS = {
+    "perforce_server": "nimble_studio_perforce_server",
+    "license_server": "nimble_studio_license_server",
+    "build_farm": "nimble_studio_build_farm",
+    "build_pipeline": "nimble_studio_build_pipeline",
+    # The combined app, synthesizing all of the above in one process
+    "suite": ".",
+}
+
+BENCHMARK_ENVIRONMENT = {
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "CDK_DEFAULT_ACCOUNT": "111111111111",
+    "CDK_DEFAULT_REGION": "us-west-2",
+    "CDK_PERFORCE_NOTIFICATION_EMAIL": "benchmark@example.com",
+    "CDK_PERFORCE_KEY_PAIR_NAME": "benchmark",
+    "CDK_BUILD_PIPELINE_KEY_PAIR_NAME": "benchmark",
+    "CDK_JENKINS_BUILD_NODE_AMI_ID": "ami-22222222222222222",
+    "CDK_DISCOVERY_CACHE_MODE": "off",
+    # The build farm stages the Incredibuild installer as an asset; any local file
+    # will do, so that the benchmark never downloads it
+    "INCREDIBUILD_INSTALLER_PATH": str(FIXTURES_PATH),
+    "INCREDIBUILD_INSTALLER_SHA256": hashlib.sha256(
+        FIXTURES_PATH.read_bytes()
+    ).hexdigest(),
+}
+
+# Metrics where any higher value than the baseline is a regression. They only
+# depend on the code, so they're the same on every machine
+GATED_METRICS = ("api_calls", "constructs")
+
+# Metrics that depend on the machine running the benchmark and how busy it is, so
+# they're reported against the baseline but never fail the run
+REPORTED_METRICS = (
+    "wall_clock_seconds",
+    "peak_python_memory_mb",
+    "peak_rss_mb",
+    "peak_jsii_rss_mb",
+)
+
+
+def _install_botocore_stub(latency_seconds: float, api_calls: Counter) -> None:
+    import boto3
+    from botocore.awsrequest import AWSResponse
+
+    sys.path.append(str(SUITE_PATH))
+    from utils import aws_clients
+
+    with open(FIXTURES_PATH, "r") as fixtures_file:
+        responses = json.load(fixtures_file)
+
+    def stub_call(event_name: str, **kwargs):
+        # event_name looks like 'before-call.ec2.DescribeSubnets'
+        _, service, operation = event_name.split(".", 2)
+        key = f"{service}.{operation}"
+        if key not in responses:
+            raise KeyError(f"No benchmark fixture for AWS call '{key}'")
+
+        api_calls[service] += 1
+        time.sleep(latency_seconds)
+        http_response = AWSResponse(url="", status_code=200, headers={}, raw=None)
+        return http_response, json.loads(json.dumps(responses[key]))
+
+    session = boto3.session.Session()
+    session.events.register("before-call.*.*", stub_call)
+    aws_clients.reset(session)
+
+
+def _peak_rss_kb(pid: int) -> int:
+    # VmHWM is the high-water mark of the process' resident set, in kilobytes
+    with open(f"/proc/{pid}/status", "r") as status_file:
+        for line in status_file:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def _child_pids(pid: int):
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as stat_file:
+                # The parent pid is the second field after the parenthesized name
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            yield int(entry)
+            yield from _child_pids(int(entry))
+
+
+def run_app(app_name: str, latency_seconds: float) -> Dict[str, Any]:
+    """Runs one app's app.py in this process and returns its measurements"""
+    api_calls: Counter = Counter()
+    _install_botocore_stub(latency_seconds, api_calls)
+
+    # app.py imports its stacks relative to the app folder, which is our cwd
+    sys.path.insert(0, os.getcwd())
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    app_globals = runpy.run_path("app.py", run_name="__main__")
+    wall_clock_seconds = time.perf_counter() - start
+    _, peak_python_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # The jsii node runtime is a child process that lives until the interpreter exits,
+    # so its high-water mark still covers all of the construction. RUSAGE_CHILDREN
+    # would only count it once it has been waited for
+    peak_rss_kb = _peak_rss_kb(os.getpid())
+    peak_jsii_rss_kb = sum(_peak_rss_kb(pid) for pid in _child_pids(os.getpid()))
+
+    return {
+        "app": app_name,
+        "wall_clock_seconds": round(wall_clock_seconds, 3),
+        "api_calls": sum(api_calls.values()),
+        "api_calls_per_service": dict(sorted(api_calls.items())),
+        "peak_python_memory_mb": round(peak_python_memory / (1024 * 1024), 1),
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1),
+        "peak_jsii_rss_mb": round(peak_jsii_rss_kb / 1024, 1),
+        "constructs": len(app_globals["app"].node.find_all()),
+    }
+
+
+def _benchmark_environment() -> Dict[str, str]:
+    environment = dict(os.environ)
+    environment.update(BENCHMARK_ENVIRONMENT)
+    for env_var in (
+        "CDK_DISCOVERY_SNAPSHOT_MODE",
+        "CDK_DISCOVERY_SNAPSHOT_PATH",
+        "AWS_PROFILE",
+    ):
+        environment.pop(env_var, None)
+    return environment
+
+
+def _run_worker(
+    app_name: str, latency_ms: float, environment: Dict[str, str]
+) -> Dict[str, Any]:
+    result = subprocess.run(
+        [
+            sys.executable,
+            str(Path(__file__).absolute()),
+            "--worker",
+            app_name,
+            "--latency-ms",
+            str(latency_ms),
+        ],
+        cwd=SUITE_PATH.joinpath(APPS[app_name]),
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"Benchmark of '{app_name}' failed with exit code {result.returncode}:\n{result.stderr}"
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark_app(app_name: str, latency_ms: float) -> Dict[str, Any]:
+    """Runs an app in a fresh interpreter, so that each one pays its own startup costs"""
+    environment = _benchmark_environment()
+    with tempfile.TemporaryDirectory() as output_directory:
+        environment["CDK_OUTDIR"] = output_directory
+        return _run_worker(app_name, latency_ms, environment)
+
+
+def check_snapshot(app_name: str) -> List[str]:
+    """
+    Records a discovery snapshot of an app, replays it without the account and region
+    in the environment, and returns how the replayed synth differs from the recorded
+    one: it must make no AWS call, and produce byte-identical templates.
+    """
+    differences = []
+    with tempfile.TemporaryDirectory() as snapshot_directory:
+        snapshot_path = Path(snapshot_directory)
+        environment = _benchmark_environment()
+        environment["CDK_DISCOVERY_SNAPSHOT_PATH"] = str(
+            snapshot_path.joinpath("discovery-snapshot.json")
+        )
+
+        environment["CDK_DISCOVERY_SNAPSHOT_MODE"] = "record"
+        environment["CDK_OUTDIR"] = str(snapshot_path.joinpath("record"))
+        _run_worker(app_name, 0, environment)
+
+        environment["CDK_DISCOVERY_SNAPSHOT_MODE"] = "replay"
+        environment["CDK_OUTDIR"] = str(snapshot_path.joinpath("replay"))
+        environment.pop("CDK_DEFAULT_ACCOUNT")
+        environment.pop("CDK_DEFAULT_REGION")
+        replayed = _run_worker(app_name, 0, environment)
+        if replayed["api_calls"]:
+            differences.append(
+                f"{app_name}: the replayed synth made {replayed['api_calls']} AWS calls"
+            )
+
+        recorded_templates = sorted(
+            path.name
+            for path in snapshot_path.joinpath("record").glob("*.template.json")
+        )
+        replayed_templates = sorted(
+            path.name
+            for path in snapshot_path.joinpath("replay").glob("*.template.json")
+        )
+        if recorded_templates != replayed_templates:
+            differences.append(
+                f"{app_name}: recorded templates {recorded_templates}, replayed {replayed_templates}"
+            )
+        for template in recorded_templates:
+            if template not in replayed_templates:
+                continue
+            recorded = snapshot_path.joinpath("record", template).read_bytes()
+            replayed = snapshot_path.joinpath("replay", template).read_bytes()
+            if recorded != replayed:
+                differences.append(
+                    f"{app_name}: {template} differs between the recorded and replayed synths"
+                )
+    return differences
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]
+):
+    regressions = []
+    for app_name, result in results.items():
+        app_baseline = baseline.get(app_name)
+        if not app_baseline:
+            continue
+        for metric in GATED_METRICS:
+            if metric in app_baseline and result[metric] > app_baseline[metric]:
+                regressions.append(
+                    f"{app_name}: {metric} is {result[metric]}, baseline {app_baseline[metric]}"
+                )
+    return regressions
+
+
+def report_changes(
+    results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]
+) -> None:
+    for app_name, result in results.items():
+        app_baseline = baseline.get(app_name)
+        if not app_baseline:
+            continue
+        changes = [
+            f"{metric} {result[metric]} ({result[metric] - app_baseline[metric]:+.1f})"
+            for metric in REPORTED_METRICS
+            if metric in app_baseline
+        ]
+        print(f"{app_name} against the baseline: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "apps",
+        nargs="*",
+        help=f"Apps to benchmark, any of {', '.join(APPS)} (default all)",
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=50.0,
+        help="Latency injected into every stubbed AWS call",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help=f"Store the results in {BASELINE_PATH.name} instead of comparing",
+    )
+    parser.add_argument(
+        "--allow-missing-baseline",
+        action="store_true",
+        help=f"Don't fail when there is no {BASELINE_PATH.name} to compare against",
+    )
+    parser.add_argument(
+        "--check-snapshots",
+        action="store_true",
+        help="Also check that replaying a discovery snapshot reproduces the templates",
+    )
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_app(args.worker, args.latency_ms / 1000)))
+        return
+
+    unknown_apps = set(args.apps) - set(APPS)
+    if unknown_apps:
+        parser.error(f"Unknown apps: {', '.join(sorted(unknown_apps))}")
+
+    results = {}
+    for app_name in args.apps or APPS:
+        results[app_name] = benchmark_app(app_name, args.latency_ms)
+        print(json.dumps(results[app_name], indent=2))
+
+    if args.check_snapshots:
+        differences = []
+        for app_name in args.apps or APPS:
+            differences.extend(check_snapshot(app_name))
+        if differences:
+            print("Discovery snapshot replays differ from their recording:")
+            for difference in differences:
+                print(f"  {difference}")
+            sys.exit(1)
+        print("Discovery snapshot replays reproduce the recorded templates.")
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f"Baseline written to {BASELINE_PATH}")
+        return
+
+    if not BASELINE_PATH.exists():
+        print(f"No baseline found at {BASELINE_PATH}, run with --update-baseline")
+        if args.allow_missing_baseline:
+            return
+        sys.exit(1)
+
+    with open(BASELINE_PATH, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    report_changes(results, baseline)
+
+    regressions = find_regressions(results, baseline)
+    if regressions:
+        print("Synth performance regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+    print("No synth performance regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,14 @@ from aws_cdk import App, Environment
 
 from nimblestudio.constructs.build_farm import NimbleStudioBuildFarmStack
 
-app = App()
+import sys
+
+sys.path.append("../../utils")
+from utils.discovery_snapshot import snapshot_context
+
+# When replaying a discovery snapshot, its recorded context lookups are fed back
+# into the App so that synthesis doesn't need to reach AWS
+app = App(context=snapshot_context())
 
 # If you don't specify 'env', this stack will be environment-agnostic.
 # Account/Region-dependent features and context lookups will not work,
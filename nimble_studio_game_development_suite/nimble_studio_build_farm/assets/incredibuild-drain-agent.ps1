@@ -0,0 +1,50 @@
+# Drains an Incredibuild worker before the Auto Scaling Group terminates it, or returns
+# it to the warm pool. Runs as a scheduled task from startup until the worker leaves
+# service.
+
+$region = "REGION_PLACEHOLDER"
+$lifecycleHookName = "LIFECYCLE_HOOK_NAME_PLACEHOLDER"
+$drainTimeoutMinutes = DRAIN_TIMEOUT_MINUTES_PLACEHOLDER
+$helperPorts = "HELPER_PORTS_PLACEHOLDER"
+$firstHelperPort, $lastHelperPort = $helperPorts.Split("-") | ForEach-Object { [int]$_ }
+$firewallRuleName = "IncredibuildDrain"
+
+function Get-InstanceMetadata($path) {
+    try {
+        $token = Invoke-RestMethod -Method PUT -Uri "http://169.254.169.254/latest/api/token" -Headers @{"X-aws-ec2-metadata-token-ttl-seconds" = "300"}
+        return Invoke-RestMethod -Uri "http://169.254.169.254/latest/meta-data/$path" -Headers @{"X-aws-ec2-metadata-token" = $token}
+    } catch {
+        return $null
+    }
+}
+
+# A worker coming back from the warm pool accepts tasks again
+Remove-NetFirewallRule -DisplayName $firewallRuleName -ErrorAction SilentlyContinue
+
+do {
+    Start-Sleep -Seconds 5
+    $targetLifecycleState = Get-InstanceMetadata "autoscaling/target-lifecycle-state"
+} while (-Not ($targetLifecycleState -eq "Terminated" -or $targetLifecycleState -like "Warmed:*"))
+
+# Stop accepting new tasks. Connections that are already established are left alone,
+# so the tasks in flight can finish
+New-NetFirewallRule -DisplayName $firewallRuleName -Direction Inbound -Protocol TCP -LocalPort $helperPorts -Action Block | Out-Null
+
+$deadline = (Get-Date).AddMinutes($drainTimeoutMinutes)
+while ((Get-Date) -lt $deadline) {
+    $inFlight = Get-NetTCPConnection -State Established -ErrorAction SilentlyContinue | Where-Object { $_.LocalPort -ge $firstHelperPort -and $_.LocalPort -le $lastHelperPort }
+    if (-Not $inFlight) {
+        break
+    }
+    Start-Sleep -Seconds 5
+}
+
+$instanceId = Get-InstanceMetadata "instance-id"
+try {
+    $autoScalingGroupName = (Get-ASAutoScalingInstance -InstanceId $instanceId -Region $region).AutoScalingGroupName
+    Complete-ASLifecycleAction -AutoScalingGroupName $autoScalingGroupName -LifecycleHookName $lifecycleHookName -InstanceId $instanceId -LifecycleActionResult CONTINUE -Region $region
+} catch {
+    # There is no termination to complete when the worker is being prepared for the
+    # warm pool
+    Write-Output "No lifecycle action to complete: $_"
+}
@@ -0,0 +1,135 @@
+# Publishes the state of the Incredibuild coordinator to CloudWatch. Runs every minute
+# from a scheduled task.
+#
+# To check the parsing against a status export captured on a coordinator, run the
+# installed copy of this script with:
+#   C:\temp\incredibuild-metrics-exporter.ps1 -StatusPath <export.xml> -DryRun
+# which prints the metrics it would publish instead of publishing them.
+
+param(
+    [string]$StatusPath = "C:\temp\incredibuild-coordinator-status.xml",
+    [switch]$DryRun
+)
+
+$region = "REGION_PLACEHOLDER"
+$namespace = "NAMESPACE_PLACEHOLDER"
+$coordinatorConsole = "INCREDIBUILD_INSTALL_PATH_PLACEHOLDER\XgCoordConsole.exe"
+$eventSource = "IncredibuildMetricsExporter"
+
+function Write-ExporterError([string]$message) {
+    if ($DryRun) {
+        Write-Error $message
+        return
+    }
+    if (-Not [System.Diagnostics.EventLog]::SourceExists($eventSource)) {
+        New-EventLog -LogName Application -Source $eventSource
+    }
+    Write-EventLog -LogName Application -Source $eventSource -EntryType Error -EventId 1 -Message $message
+}
+
+# Sums the first of the given attributes found on each node. Returns $null, rather than
+# a plausible zero, when a node has none of them, so that a status export that doesn't
+# match what we expect never publishes misleading metrics
+function Get-Sum($nodes, [string[]]$names) {
+    $sum = 0
+    foreach ($node in $nodes) {
+        $name = $names | Where-Object { $node.HasAttribute($_) } | Select-Object -First 1
+        if (-Not $name) {
+            return $null
+        }
+        $sum += [double]$node.GetAttribute($name)
+    }
+    return $sum
+}
+
+# Export the coordinator's view of its agents and builds, unless we're checking a
+# captured export
+if (-Not $DryRun) {
+    Remove-Item -Path $StatusPath -ErrorAction SilentlyContinue
+    & $coordinatorConsole /Export="$StatusPath" | Out-Null
+}
+try {
+    [xml]$status = Get-Content -Path $StatusPath -Raw -ErrorAction Stop
+} catch {
+    Write-ExporterError "Unable to read the Incredibuild coordinator status export ${StatusPath}: $_"
+    exit 1
+}
+
+# An export without the agent and build lists doesn't have the schema we expect, and
+# its empty lists would otherwise read as an idle farm
+foreach ($list in @("Agents", "Builds")) {
+    if (-Not $status.SelectSingleNode("//$list")) {
+        Write-ExporterError "The Incredibuild coordinator status export $StatusPath has no $list element, no metrics are published."
+        exit 1
+    }
+}
+
+$agents = @($status.SelectNodes("//Agent") | Where-Object { $_.GetAttribute("Connected") -ne "False" })
+$builds = @($status.SelectNodes("//Build"))
+
+$availableHelperCores = Get-Sum $agents @("HelperCores", "Cores")
+$busyHelperCores = Get-Sum $agents @("BusyCores", "ActiveCores")
+
+$requestedCores = Get-Sum $builds @("RequestedCores")
+$assignedCores = Get-Sum $builds @("AssignedCores")
+$queuedHelperCores = $null
+if ($null -ne $requestedCores -and $null -ne $assignedCores) {
+    $queuedHelperCores = [Math]::Max(0, $requestedCores - $assignedCores)
+}
+
+$runningBuilds = $null
+$queuedBuilds = $null
+if (-Not ($builds | Where-Object { -Not $_.HasAttribute("State") })) {
+    $queuedBuilds = @($builds | Where-Object { $_.GetAttribute("State") -eq "Queued" }).Count
+    $runningBuilds = $builds.Count - $queuedBuilds
+}
+
+# Utilization is undefined, rather than zero, without any helper cores
+$helperCoreUtilization = $null
+if ($availableHelperCores -gt 0 -and $null -ne $busyHelperCores) {
+    $helperCoreUtilization = 100 * $busyHelperCores / $availableHelperCores
+}
+
+$licensedHelperCores = Get-Sum @($status.DocumentElement) @("LicensedCores")
+
+$metrics = [ordered]@{
+    "CONNECTED_AGENTS_PLACEHOLDER"        = @($agents.Count, "Count")
+    "AVAILABLE_HELPER_CORES_PLACEHOLDER"  = @($availableHelperCores, "Count")
+    "BUSY_HELPER_CORES_PLACEHOLDER"       = @($busyHelperCores, "Count")
+    "QUEUED_HELPER_CORES_PLACEHOLDER"     = @($queuedHelperCores, "Count")
+    "HELPER_CORE_UTILIZATION_PLACEHOLDER" = @($helperCoreUtilization, "Percent")
+    "RUNNING_BUILDS_PLACEHOLDER"          = @($runningBuilds, "Count")
+    "QUEUED_BUILDS_PLACEHOLDER"           = @($queuedBuilds, "Count")
+    "LICENSED_HELPER_CORES_PLACEHOLDER"   = @($licensedHelperCores, "Count")
+}
+
+# Metrics missing from the export are left out, and reported
+$missingMetrics = @($metrics.Keys | Where-Object { $null -eq $metrics[$_][0] })
+if ($missingMetrics) {
+    Write-ExporterError "The Incredibuild coordinator status export $StatusPath is missing the attributes of $($missingMetrics -join ', '), which are not published."
+}
+
+if ($DryRun) {
+    $metrics.Keys | Where-Object { $missingMetrics -notcontains $_ } | ForEach-Object {
+        [PSCustomObject]@{ MetricName = $_; Value = $metrics[$_][0]; Unit = $metrics[$_][1] }
+    } | Format-Table
+    exit 0
+}
+
+$timestamp = (Get-Date).ToUniversalTime()
+$metricData = foreach ($name in $metrics.Keys) {
+    if ($missingMetrics -contains $name) {
+        continue
+    }
+    $datum = New-Object Amazon.CloudWatch.Model.MetricDatum
+    $datum.MetricName = $name
+    $datum.Value = $metrics[$name][0]
+    $datum.Unit = $metrics[$name][1]
+    $datum.TimestampUtc = $timestamp
+    $datum.StorageResolution = 60
+    $datum
+}
+
+if ($metricData) {
+    Write-CWMetricData -Namespace $namespace -MetricData $metricData -Region $region
+}
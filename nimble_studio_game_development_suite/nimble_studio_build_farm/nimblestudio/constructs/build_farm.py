@@ -9,12 +9,15 @@ from aws_cdk import Stack
 from constructs import Construct
 
 from nimblestudio.constructs.incredibuild_coordinator import IncredibuildCoordinator
+from nimblestudio.constructs.incredibuild_image_stack import IncredibuildImageStack
+from nimblestudio.constructs.incredibuild_installer import IncredibuildInstaller
+from nimblestudio.constructs.incredibuild_schedule import load_worker_schedule
 from nimblestudio.constructs.incredibuild_workers import IncredibuildWorkers
 
 import sys
 
 sys.path.append("../../utils")
-from utils.config_retriever import ConfigRetriever
+from utils.config_retriever import get_config_retriever
 
 
 class NimbleStudioBuildFarmStack(Stack):
@@ -24,7 +27,19 @@ class NimbleStudioBuildFarmStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        config_retriever = ConfigRetriever()
+        config_retriever = get_config_retriever()
+        config_retriever.prefetch(
+            "studio",
+            "vpc_id",
+            "workstations_sg_id",
+            "vpce_sg_id",
+            "render_worker_subnets",
+            "worker_support_subnet",
+            "worker_support_subnet_id",
+            "worker_support_nacl_id",
+            "s3_gateway_endpoints",
+            "hosted_zone",
+        )
 
         # Find the studio in this account, and retrieve the studio id
         studio_id = config_retriever.studio_id
@@ -66,16 +81,19 @@ class NimbleStudioBuildFarmStack(Stack):
         )
 
         # Now we find the RenderWorkers and WorkerSupport subnets and create constructs
-        # referencing those existing subnets
-        render_worker_subnet_info = config_retriever.render_worker_subnet
-        render_worker_subnet_id = render_worker_subnet_info["SubnetId"]
-        render_worker_subnet = ec2.Subnet.from_subnet_attributes(
-            self,
-            render_worker_subnet_id,
-            availability_zone=render_worker_subnet_info["AvailabilityZone"],
-            ipv4_cidr_block=render_worker_subnet_info["CidrBlock"],
-            subnet_id=render_worker_subnet_id,
-        )
+        # referencing those existing subnets. Workers are spread across the RenderWorkers
+        # subnets of every AZ (and of the local zones near your artists), so that a large
+        # scale out isn't limited to the capacity of a single AZ
+        self.render_worker_subnets: List[ec2.Subnet] = [
+            ec2.Subnet.from_subnet_attributes(
+                self,
+                render_worker_subnet_info["SubnetId"],
+                availability_zone=render_worker_subnet_info["AvailabilityZone"],
+                ipv4_cidr_block=render_worker_subnet_info["CidrBlock"],
+                subnet_id=render_worker_subnet_info["SubnetId"],
+            )
+            for render_worker_subnet_info in config_retriever.render_worker_subnets
+        ]
 
         worker_support_subnet_info = config_retriever.worker_support_subnet
         worker_support_subnet_id = config_retriever.worker_support_subnet_id
@@ -87,9 +105,32 @@ class NimbleStudioBuildFarmStack(Stack):
             subnet_id=worker_support_subnet_id,
         )
 
-        self.render_worker_subnets: List[ec2.Subnet] = [render_worker_subnet]
         self.worker_support_subnets: List[ec2.Subnet] = [worker_support_subnet]
 
+        # You can set the INCREDIBUILD_CLUSTER_PLACEMENT environment variable to "true"
+        # to launch the coordinator and workers in a cluster placement group. Cluster
+        # placement groups live in a single AZ, so workers are then limited to the
+        # RenderWorkers subnets in the coordinator's AZ
+        if os.getenv("INCREDIBUILD_CLUSTER_PLACEMENT", "false").lower() == "true":
+            self.placement_group = ec2.CfnPlacementGroup(
+                self, "IncredibuildPlacementGroup", strategy="cluster"
+            )
+            placement_group_name = self.placement_group.ref
+
+            self.render_worker_subnets = [
+                subnet
+                for subnet in self.render_worker_subnets
+                if subnet.availability_zone == worker_support_subnet.availability_zone
+            ]
+            if not self.render_worker_subnets:
+                print(
+                    f"ERROR: Couldn't find a RenderWorkers subnet in {worker_support_subnet.availability_zone}, where the Incredibuild coordinator runs."
+                )
+                sys.exit(1)
+        else:
+            self.placement_group = None
+            placement_group_name = None
+
         # Create a VPC construct referencing the studio's VPC
         self.vpc = ec2.Vpc.from_lookup(self, "Vpc", vpc_id=vpc_id)
 
@@ -105,6 +146,22 @@ class NimbleStudioBuildFarmStack(Stack):
         # We locate the Incredibuild license file if it exists
         incredibuild_path = self._get_incredibuild_path()
 
+        # Stage the Incredibuild installer in this region, so that instances download
+        # it from S3 rather than from the Internet
+        self.incredibuild_installer = IncredibuildInstaller(
+            self,
+            "IncredibuildInstaller",
+            download_url=NimbleStudioBuildFarmStack.INCREDIBUILD_SILENT_INSTALLER_DOWNLOAD,
+            search_path=incredibuild_path,
+        )
+        self._add_s3_gateway_endpoint(
+            s3_gateway_endpoints=config_retriever.s3_gateway_endpoints,
+            subnet_ids=[
+                subnet.subnet_id
+                for subnet in self.render_worker_subnets + self.worker_support_subnets
+            ],
+        )
+
         incredibuild_license_path = self._get_incredibuild_license_path(
             incredibuild_path
         )
@@ -117,12 +174,39 @@ class NimbleStudioBuildFarmStack(Stack):
         else:
             self.incredibuild_license = None
 
+        # You can set the INCREDIBUILD_GOLDEN_AMIS environment variable to "true" to
+        # bake the coordinator and worker software into AMIs, so that instances don't
+        # have to install it when they launch
+        if os.getenv("INCREDIBUILD_GOLDEN_AMIS", "false").lower() == "true":
+            self.incredibuild_images = IncredibuildImageStack(
+                self,
+                "IncredibuildImageStack",
+                incredibuild_coordinator_domain_name=IncredibuildCoordinator.get_domain_name(
+                    config_retriever.hosted_zone["name"]
+                ),
+                incredibuild_installer=self.incredibuild_installer,
+                vpc=self.vpc,
+                vpc_endpoints_sg=vpc_endpoints_sg,
+                build_subnets=self.worker_support_subnets,
+            )
+            # The image builds download Chocolatey from the Internet, which needs the
+            # outbound rules of the WorkerSupport Network ACL
+            self.incredibuild_images.node.add_dependency(worker_support_network_acl)
+            coordinator_image_id = self.incredibuild_images.coordinator_image_id
+            worker_image_id = self.incredibuild_images.worker_image_id
+        else:
+            self.incredibuild_images = None
+            coordinator_image_id = None
+            worker_image_id = None
+
         # Create an Incredibuild coordinator
         self.incredibuild_coordinator = IncredibuildCoordinator(
             self,
             "IncredibuildCoordinatorConstruct",
-            incredibuild_installer_location=NimbleStudioBuildFarmStack.INCREDIBUILD_SILENT_INSTALLER_DOWNLOAD,
+            coordinator_image_id=coordinator_image_id,
+            incredibuild_installer=self.incredibuild_installer,
             incredibuild_license=self.incredibuild_license,
+            placement_group_name=placement_group_name,
             studio_hosted_zone_attributes=config_retriever.hosted_zone,
             vpc=self.vpc,
             vpc_endpoints_sg=vpc_endpoints_sg,
@@ -138,9 +222,12 @@ class NimbleStudioBuildFarmStack(Stack):
             "IncredibuildWorkersConstruct",
             incredibuild_coordinator_domain_name=self.incredibuild_coordinator.incredibuild_server_record.domain_name,
             incredibuild_coordinator_security_group=self.incredibuild_coordinator.coordinator_security_group,
-            incredibuild_installer_location=NimbleStudioBuildFarmStack.INCREDIBUILD_SILENT_INSTALLER_DOWNLOAD,
+            incredibuild_installer=self.incredibuild_installer,
             vpc=self.vpc,
             vpc_endpoints_sg=vpc_endpoints_sg,
+            placement_group_name=placement_group_name,
+            schedule_windows=self._get_worker_schedule(incredibuild_path),
+            worker_image_id=worker_image_id,
             worker_subnets=self.render_worker_subnets,
             workstations_security_group=workstations_sg,
         )
@@ -179,6 +266,68 @@ New-ItemProperty -Path $RegistryPath -Name $Name -Value $Value -PropertyType Str
             ],
         )
 
+    def _add_s3_gateway_endpoint(
+        self, *, s3_gateway_endpoints: List[dict], subnet_ids: List[str]
+    ) -> None:
+        # You can set the INCREDIBUILD_S3_GATEWAY_ENDPOINT environment variable to
+        # "true" to route the build farm subnets' S3 traffic through a gateway endpoint,
+        # where the studio VPC doesn't already have one
+        if os.getenv("INCREDIBUILD_S3_GATEWAY_ENDPOINT", "false").lower() != "true":
+            if not s3_gateway_endpoints:
+                print(
+                    "WARNING: The studio VPC has no S3 gateway endpoint, so instances will "
+                    "download the Incredibuild installer from S3 over the Internet. Set "
+                    "INCREDIBUILD_S3_GATEWAY_ENDPOINT to true to create one."
+                )
+            return
+
+        # The route tables come from the discovery rather than from the looked up VPC,
+        # which is a placeholder without subnets on the first synth. Route tables that
+        # an existing S3 gateway endpoint is attached to already route S3 through it,
+        # and can't take a second S3 route
+        config_retriever = get_config_retriever()
+        covered_route_table_ids = {
+            route_table_id
+            for endpoint in s3_gateway_endpoints
+            for route_table_id in endpoint["route_table_ids"]
+        }
+        route_table_ids = [
+            route_table_id
+            for route_table_id in config_retriever.get_subnet_route_table_ids(
+                config_retriever.route_tables, subnet_ids
+            )
+            if route_table_id not in covered_route_table_ids
+        ]
+        if not route_table_ids:
+            print(
+                "The build farm subnets already route S3 traffic through a gateway "
+                "endpoint, no new one is created."
+            )
+            return
+
+        ec2.CfnVPCEndpoint(
+            self,
+            "S3GatewayEndpoint",
+            service_name=f"com.amazonaws.{self.region}.s3",
+            vpc_id=config_retriever.vpc_id,
+            vpc_endpoint_type="Gateway",
+            route_table_ids=route_table_ids,
+        )
+
+    def _get_worker_schedule(self, incredibuild_path: Path) -> List[dict]:
+        # You can describe when the workers should be scaled up ahead of demand in a
+        # worker_schedule.json file next to your license, or point the
+        # WORKER_SCHEDULE_PATH environment variable at one
+        schedule_path = os.getenv("WORKER_SCHEDULE_PATH")
+        if schedule_path:
+            return load_worker_schedule(Path(schedule_path))
+
+        schedule_path = incredibuild_path.joinpath("worker_schedule.json")
+        if schedule_path.exists():
+            return load_worker_schedule(schedule_path)
+
+        return []
+
     def _get_incredibuild_path(self):
         return Path(__file__).parent.parent.parent.joinpath("incredibuild").absolute()
 
@@ -1,4 +1,5 @@
 import json
+from pathlib import Path
 from typing import List
 
 from aws_cdk import (
@@ -15,7 +16,9 @@ from aws_cdk.aws_ec2 import (
     InstanceClass,
     InstanceSize,
     InstanceType,
+    MachineImage,
     NetworkAcl,
+    OperatingSystemType,
     Port,
     SecurityGroup,
     Subnet,
@@ -27,26 +30,63 @@ from aws_cdk.aws_ec2 import (
     WindowsVersion,
 )
 
-from aws_cdk.aws_iam import ManagedPolicy, Role, ServicePrincipal
+from aws_cdk.aws_iam import ManagedPolicy, PolicyStatement, Role, ServicePrincipal
 from aws_cdk.aws_route53 import ARecord, HostedZone, RecordTarget
 from aws_cdk.aws_s3_assets import Asset
 from aws_cdk.aws_ssm import StringParameter
 
 from constructs import Construct
 
-from nimblestudio.utils import add_user_data_cloudwatch_agent
+from nimblestudio.constructs.incredibuild_installer import IncredibuildInstaller
+from nimblestudio.constructs.incredibuild_metrics import (
+    AVAILABLE_HELPER_CORES,
+    BUSY_HELPER_CORES,
+    CONNECTED_AGENTS,
+    HELPER_CORE_UTILIZATION,
+    INCREDIBUILD_METRICS_NAMESPACE,
+    LICENSED_HELPER_CORES,
+    QUEUED_BUILDS,
+    QUEUED_HELPER_CORES,
+    RUNNING_BUILDS,
+)
+from nimblestudio.utils import (
+    add_user_data_cloudwatch_agent,
+    add_user_data_scheduled_script,
+    get_cloudwatch_agent_metrics_config,
+)
+
+import sys
+
+sys.path.append("../../utils")
+from utils.ssm_configuration import SsmConfiguration
+from utils.user_data import UserDataTemplate
+
+ASSETS_PATH = Path(__file__).parent.parent.parent.joinpath("assets")
 
 
 class IncredibuildCoordinator(Construct):
     INCREDIBUILD_LICENSE_LOCAL_PATH = r"C:\temp\license.IB_lic"
+    CFN_SIGNAL_SENT_MARKER_PATH = r"C:\temp\cfn-signal-sent"
+    INCREDIBUILD_INSTALL_PATH = r"C:\Program Files (x86)\IncrediBuild"
+    METRICS_EXPORTER_LOCAL_PATH = r"C:\temp\incredibuild-metrics-exporter.ps1"
+    METRICS_EXPORTER_TASK_NAME = "IncredibuildMetricsExporter"
+
+    # Processes of the Incredibuild coordinator, whose CPU, memory and I/O are collected
+    PROCESS_PATTERNS = ["CoordService"]
+
+    # Burstable instances can't join a cluster placement group, so a coordinator in
+    # one runs on a general purpose type with a higher network bandwidth instead
+    CLUSTER_PLACEMENT_INSTANCE_TYPE = "m5n.large"
 
     def __init__(
         self,
         scope: Construct,
         construct_id: str,
         *,
-        incredibuild_installer_location: str,
+        coordinator_image_id: str = None,
+        incredibuild_installer: IncredibuildInstaller,
         incredibuild_license: Asset,
+        placement_group_name: str = None,
         studio_hosted_zone_attributes: dict,
         vpc: Vpc,
         vpc_endpoints_sg: SecurityGroup,
@@ -114,42 +154,75 @@ class IncredibuildCoordinator(Construct):
             role_name="IncredibuildCoordinatorRole",
         )
 
+        # The coordinator starts from a golden AMI with Incredibuild already installed
+        # when one is provided, and installs it itself otherwise
+        coordinator_machine_image = (
+            MachineImage.generic_windows(
+                {
+                    f"{Stack.of(self).region}": coordinator_image_id,
+                }
+            )
+            if coordinator_image_id
+            else WindowsImage(WindowsVersion.WINDOWS_SERVER_2022_ENGLISH_FULL_BASE)
+        )
+
+        coordinator_instance_type = (
+            InstanceType(IncredibuildCoordinator.CLUSTER_PLACEMENT_INSTANCE_TYPE)
+            if placement_group_name
+            else InstanceType.of(InstanceClass.BURSTABLE3, InstanceSize.LARGE)
+        )
+
         self.coordinator_instance = Instance(
             self,
             "IncredibuildCoordinator",
-            instance_type=InstanceType.of(InstanceClass.BURSTABLE3, InstanceSize.LARGE),
-            machine_image=WindowsImage(
-                WindowsVersion.WINDOWS_SERVER_2022_ENGLISH_FULL_BASE
-            ),
+            instance_type=coordinator_instance_type,
+            machine_image=coordinator_machine_image,
             role=coordinator_instance_role,
             # The deploy will fail if the co-ordinator takes over 10 minutes to
             # configure itself
             resource_signal_timeout=Duration.minutes(10),
             security_group=self.coordinator_security_group,
-            user_data=UserData.custom("<persist>true</persist>"),
+            user_data=UserData.for_windows(),
             vpc=vpc,
             vpc_subnets=SubnetSelection(subnets=worker_support_subnets),
         )
 
+        if placement_group_name:
+            self.coordinator_instance.instance.placement_group_name = (
+                placement_group_name
+            )
+
         Tags.of(self.coordinator_instance).add("Name", "Incredibuild Coordinator")
 
-        # Configure UserData to configure CloudWatch, download Incredibuild and the
+        # Build a script to configure CloudWatch, download Incredibuild and the
         # Incredibuild license, and then automatically configure the Incredibuild
-        # coordinator
+        # coordinator. It is applied through SSM rather than user data, so changing it
+        # re-runs it on the coordinator instead of restarting or replacing it
         self._user_data = UserData.for_windows()
         self._add_user_data_cloudwatch_agent(
             coordinator_instance_role=coordinator_instance_role
         )
         self._add_incredibuild_installer_user_data(
-            incredibuild_installer_location=incredibuild_installer_location,
+            coordinator_instance_role=coordinator_instance_role,
+            incredibuild_installer=incredibuild_installer,
         )
         self._add_incredibuild_license_registration_user_data(
             coordinator_instance_role=coordinator_instance_role,
             incredibuild_license=incredibuild_license,
         )
+        self._add_metrics_exporter_user_data(
+            coordinator_instance_role=coordinator_instance_role
+        )
         self._signal_cloudformation_success_user_data()
 
-        self.coordinator_instance.user_data.add_commands(self._user_data.render())
+        self.configuration = SsmConfiguration(
+            self,
+            "IncredibuildCoordinatorConfiguration",
+            script=self._user_data.render(),
+            instances=[self.coordinator_instance],
+            platform=OperatingSystemType.WINDOWS,
+            description="Installs and configures the Incredibuild coordinator",
+        )
 
         # Find the existing Route 53 hosted zone for the coordinator, and add an A
         # record in it pointing to the Incredibuild coordinator
@@ -170,7 +243,9 @@ class IncredibuildCoordinator(Construct):
             ),
             zone=self._hosted_zone,
             comment="Private record for Incredibuild Coordinator",
-            record_name=f"incredibuild.{self._hosted_zone.zone_name}",
+            record_name=IncredibuildCoordinator.get_domain_name(
+                self._hosted_zone.zone_name
+            ),
         )
 
         CfnOutput(
@@ -179,6 +254,10 @@ class IncredibuildCoordinator(Construct):
             value=self.incredibuild_server_record.domain_name,
         )
 
+    @staticmethod
+    def get_domain_name(zone_name: str) -> str:
+        return f"incredibuild.{zone_name.rstrip('.')}"
+
     # Configure the CloudWatch agent so that we upload logs to CloudWatch
     def _add_user_data_cloudwatch_agent(self, coordinator_instance_role: Role) -> None:
         # Store the cloudwatch configuration in Parameter Store
@@ -205,28 +284,40 @@ class IncredibuildCoordinator(Construct):
             string_value=json.dumps(cloudwatch_config),
         )
 
+        metrics_config = get_cloudwatch_agent_metrics_config(
+            dimensions=["InstanceId", "InstanceType"],
+            process_patterns=IncredibuildCoordinator.PROCESS_PATTERNS,
+        )
+
         add_user_data_cloudwatch_agent(
             self,
             self._user_data,
             cloudwatch_ssm_param=cloudwatch_ssm_param,
             instance_role=coordinator_instance_role,
+            metrics_config=metrics_config,
         )
 
     def _add_incredibuild_installer_user_data(
         self,
         *,
-        incredibuild_installer_location: str,
+        coordinator_instance_role: Role,
+        incredibuild_installer: IncredibuildInstaller,
     ) -> None:
 
-        # Download the Incredibuild silent installer
+        # Download and install the Incredibuild silent installer, unless Incredibuild
+        # is already installed by the golden AMI or an earlier run of this script
         incredibuild_installer_local_path = r"C:\temp\IBSetupConsole.exe"
         self._user_data.add_commands(
-            f'(New-Object System.Net.WebClient).DownloadFile("{incredibuild_installer_location}", "{incredibuild_installer_local_path}")'
+            f'if (-Not (Test-Path "{IncredibuildCoordinator.INCREDIBUILD_INSTALL_PATH}")) {{'
+        )
+        incredibuild_installer.add_download_commands(
+            self._user_data,
+            local_file=incredibuild_installer_local_path,
+            grantee=coordinator_instance_role,
         )
-
-        # Install Incredibuild
         self._user_data.add_commands(
             f"{incredibuild_installer_local_path} /install /Components=Coordinator",
+            "}",
         )
 
     def _add_incredibuild_license_registration_user_data(
@@ -249,8 +340,10 @@ class IncredibuildCoordinator(Construct):
             # Activate a free trial license
             self._user_data.add_commands(
                 f"""
-Set-ExecutionPolicy Bypass -Scope Process -Force; [System.Net.ServicePointManager]::SecurityProtocol = [System.Net.ServicePointManager]::SecurityProtocol -bor 3072; iex ((New-Object System.Net.WebClient).DownloadString('https://community.chocolatey.org/install.ps1'))
-choco install vcredist2015 -y
+if (-Not (Get-Command choco -ErrorAction SilentlyContinue)) {{
+  Set-ExecutionPolicy Bypass -Scope Process -Force; [System.Net.ServicePointManager]::SecurityProtocol = [System.Net.ServicePointManager]::SecurityProtocol -bor 3072; iex ((New-Object System.Net.WebClient).DownloadString('https://community.chocolatey.org/install.ps1'))
+  choco install vcredist2015 -y
+}}
 
 $licenseApi = "https://f65xom4rf9.execute-api.eu-central-1.amazonaws.com/default/license_generator?machine_id="
 $licensePath = "{IncredibuildCoordinator.INCREDIBUILD_LICENSE_LOCAL_PATH}"
@@ -271,8 +364,54 @@ $bytes = [Convert]::FromBase64String($data)
 """
         )
 
+    def _add_metrics_exporter_user_data(self, *, coordinator_instance_role: Role):
+        # Publish the coordinator's agents, cores, builds and license usage to
+        # CloudWatch every minute, for the worker scaling policies and for alarms
+        coordinator_instance_role.add_to_policy(
+            PolicyStatement(
+                actions=["cloudwatch:PutMetricData"],
+                resources=["*"],
+                conditions={
+                    "StringEquals": {
+                        "cloudwatch:namespace": INCREDIBUILD_METRICS_NAMESPACE
+                    }
+                },
+            )
+        )
+
+        metrics_exporter = UserDataTemplate.load(
+            ASSETS_PATH.joinpath("incredibuild-metrics-exporter.ps1")
+        ).render(
+            {
+                "REGION_PLACEHOLDER": Stack.of(self).region,
+                "NAMESPACE_PLACEHOLDER": INCREDIBUILD_METRICS_NAMESPACE,
+                "INCREDIBUILD_INSTALL_PATH_PLACEHOLDER": IncredibuildCoordinator.INCREDIBUILD_INSTALL_PATH,
+                "CONNECTED_AGENTS_PLACEHOLDER": CONNECTED_AGENTS,
+                "AVAILABLE_HELPER_CORES_PLACEHOLDER": AVAILABLE_HELPER_CORES,
+                "BUSY_HELPER_CORES_PLACEHOLDER": BUSY_HELPER_CORES,
+                "QUEUED_HELPER_CORES_PLACEHOLDER": QUEUED_HELPER_CORES,
+                "HELPER_CORE_UTILIZATION_PLACEHOLDER": HELPER_CORE_UTILIZATION,
+                "RUNNING_BUILDS_PLACEHOLDER": RUNNING_BUILDS,
+                "QUEUED_BUILDS_PLACEHOLDER": QUEUED_BUILDS,
+                "LICENSED_HELPER_CORES_PLACEHOLDER": LICENSED_HELPER_CORES,
+            }
+        )
+
+        add_user_data_scheduled_script(
+            self._user_data,
+            local_path=IncredibuildCoordinator.METRICS_EXPORTER_LOCAL_PATH,
+            script=metrics_exporter,
+            task_name=IncredibuildCoordinator.METRICS_EXPORTER_TASK_NAME,
+            trigger="New-ScheduledTaskTrigger -Once -At (Get-Date) -RepetitionInterval (New-TimeSpan -Minutes 1)",
+        )
+
     def _signal_cloudformation_success_user_data(self):
-        # Send the success signal to CloudFormation
+        # Send the success signal to CloudFormation, only once since the configuration
+        # is re-applied whenever it changes
+        marker_path = IncredibuildCoordinator.CFN_SIGNAL_SENT_MARKER_PATH
         self._user_data.add_commands(
-            f"cfn-signal --stack {Stack.of(self).stack_name} --resource {Stack.of(self).get_logical_id(self.coordinator_instance.node.default_child)} --region {Stack.of(self).region} --success true"
+            f'if (-not (Test-Path "{marker_path}")) {{',
+            f"  cfn-signal --stack {Stack.of(self).stack_name} --resource {Stack.of(self).get_logical_id(self.coordinator_instance.node.default_child)} --region {Stack.of(self).region} --success true",
+            f'  New-Item -ItemType File -Path "{marker_path}" | Out-Null',
+            "}",
         )
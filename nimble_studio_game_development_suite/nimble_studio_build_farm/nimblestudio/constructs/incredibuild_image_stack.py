@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import re
+from typing import List
+
+from aws_cdk import NestedStack, Stack, Tags
+
+from aws_cdk.aws_ec2 import (
+    CfnSecurityGroupIngress,
+    SecurityGroup,
+    Subnet,
+    Vpc,
+)
+
+from aws_cdk.aws_iam import CfnInstanceProfile, ManagedPolicy, Role, ServicePrincipal
+from aws_cdk.aws_imagebuilder import (
+    CfnComponent,
+    CfnImage,
+    CfnImageRecipe,
+    CfnInfrastructureConfiguration,
+)
+
+from constructs import Construct
+
+from nimblestudio.constructs.incredibuild_installer import IncredibuildInstaller
+
+
+class IncredibuildImageStack(NestedStack):
+    """
+    Bakes the Incredibuild coordinator and worker software into AMIs with EC2 Image
+    Builder, so that instances don't install it on every launch.
+
+    Components and recipes are versioned from their content, so an AMI is only rebuilt
+    when what goes into it changes, or when INCREDIBUILD_IMAGE_REVISION is bumped to
+    pick up the latest patches of the base image.
+    """
+
+    INCREDIBUILD_INSTALLER_LOCAL_PATH = r"C:\temp\IBSetupConsole.exe"
+
+    # Image Builder resolves 'x.x.x' to the latest version at build time
+    BASE_IMAGE_NAME = "windows-server-2022-english-full-base-x86/x.x.x"
+    CLOUDWATCH_AGENT_COMPONENT_NAME = "amazon-cloudwatch-agent-windows/x.x.x"
+
+    BUILD_INSTANCE_TYPES = ["c5.xlarge"]
+
+    TOKEN_PATTERN = re.compile(r"\$\{Token\[[^\]]*\]\}")
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        *,
+        incredibuild_coordinator_domain_name: str,
+        incredibuild_installer: IncredibuildInstaller,
+        vpc: Vpc,
+        vpc_endpoints_sg: SecurityGroup,
+        build_subnets: List[Subnet],
+        **kwargs,
+    ):
+        super().__init__(scope, id, **kwargs)
+
+        self._revision = os.getenv("INCREDIBUILD_IMAGE_REVISION", "0")
+
+        # Image Builder runs the components through SSM, so the build instances need
+        # to reach the VPC endpoints as well as the Internet for Chocolatey
+        build_security_group = SecurityGroup(
+            self,
+            "IncredibuildImageBuildSG",
+            allow_all_outbound=True,
+            description="Allow Incredibuild image builds to download their installers",
+            vpc=vpc,
+        )
+        Tags.of(build_security_group).add("Name", "Incredibuild Image Build SG")
+
+        vpc_endpoints_ingress = CfnSecurityGroupIngress(
+            self,
+            "VpcEndpointsIngress",
+            group_id=vpc_endpoints_sg.security_group_id,
+            source_security_group_id=build_security_group.security_group_id,
+            ip_protocol="tcp",
+            from_port=443,
+            to_port=443,
+            description="Allow Incredibuild image builds to connect to the VPC endpoints",
+        )
+
+        build_instance_role = Role(
+            self,
+            "IncredibuildImageBuildRole",
+            assumed_by=ServicePrincipal("ec2.amazonaws.com"),
+            managed_policies=[
+                ManagedPolicy.from_aws_managed_policy_name(
+                    "AmazonSSMManagedInstanceCore"
+                ),
+                ManagedPolicy.from_aws_managed_policy_name(
+                    "EC2InstanceProfileForImageBuilder"
+                ),
+            ],
+        )
+        build_instance_profile = CfnInstanceProfile(
+            self,
+            "IncredibuildImageBuildInstanceProfile",
+            roles=[build_instance_role.role_name],
+        )
+
+        self._infrastructure_configuration = CfnInfrastructureConfiguration(
+            self,
+            "IncredibuildImageInfrastructure",
+            name="IncredibuildImageInfrastructure",
+            instance_profile_name=build_instance_profile.ref,
+            instance_types=IncredibuildImageStack.BUILD_INSTANCE_TYPES,
+            security_group_ids=[build_security_group.security_group_id],
+            subnet_id=build_subnets[0].subnet_id,
+            terminate_instance_on_failure=True,
+        )
+        self._infrastructure_configuration.node.add_dependency(vpc_endpoints_ingress)
+
+        incredibuild_installer.asset.grant_read(build_instance_role)
+        download_installer_commands = incredibuild_installer.download_commands(
+            IncredibuildImageStack.INCREDIBUILD_INSTALLER_LOCAL_PATH
+        )
+
+        coordinator_component = self._create_powershell_component(
+            "IncredibuildCoordinatorComponent",
+            name="IncredibuildCoordinator",
+            description="Installs the Incredibuild coordinator and its license tooling",
+            commands=[
+                *download_installer_commands,
+                f"{IncredibuildImageStack.INCREDIBUILD_INSTALLER_LOCAL_PATH} /install /Components=Coordinator",
+                # Free trial licenses are generated with tools that need the Visual C++
+                # runtime, which we install through Chocolatey
+                "Set-ExecutionPolicy Bypass -Scope Process -Force; [System.Net.ServicePointManager]::SecurityProtocol = [System.Net.ServicePointManager]::SecurityProtocol -bor 3072; iex ((New-Object System.Net.WebClient).DownloadString('https://community.chocolatey.org/install.ps1'))",
+                "choco install vcredist2015 -y",
+            ],
+        )
+
+        worker_component = self._create_powershell_component(
+            "IncredibuildAgentComponent",
+            name="IncredibuildAgent",
+            description="Installs the Incredibuild agent, connected to the coordinator",
+            commands=[
+                *download_installer_commands,
+                f'{IncredibuildImageStack.INCREDIBUILD_INSTALLER_LOCAL_PATH} /install /Components=Agent /Coordinator="{incredibuild_coordinator_domain_name}"',
+            ],
+        )
+
+        # Workers can start from the AMI in WORKER_AMI, which may have Visual Studio
+        # and any other software you want Incredibuild to use
+        worker_base_image = os.getenv("WORKER_AMI") or self._managed_arn(
+            "image", IncredibuildImageStack.BASE_IMAGE_NAME
+        )
+
+        self.coordinator_image = self._create_image(
+            "IncredibuildCoordinator",
+            parent_image=self._managed_arn(
+                "image", IncredibuildImageStack.BASE_IMAGE_NAME
+            ),
+            components=[coordinator_component],
+        )
+        self.worker_image = self._create_image(
+            "IncredibuildWorker",
+            parent_image=worker_base_image,
+            components=[worker_component],
+        )
+
+        self.coordinator_image_id = self.coordinator_image.attr_image_id
+        self.worker_image_id = self.worker_image.attr_image_id
+
+    def _create_powershell_component(
+        self, construct_id: str, *, name: str, description: str, commands: List[str]
+    ) -> CfnComponent:
+        # JSON is valid YAML, so the component document can be written with json.dumps
+        data = json.dumps(
+            {
+                "name": name,
+                "description": description,
+                "schemaVersion": 1.0,
+                "phases": [
+                    {
+                        "name": "build",
+                        "steps": [
+                            {
+                                "name": "Install",
+                                "action": "ExecutePowerShell",
+                                "inputs": {"commands": commands},
+                            }
+                        ],
+                    }
+                ],
+            },
+            indent=2,
+        )
+
+        return CfnComponent(
+            self,
+            construct_id,
+            name=name,
+            description=description,
+            platform="Windows",
+            version=self._content_version(data),
+            data=data,
+        )
+
+    def _create_image(
+        self, name: str, *, parent_image: str, components: List[CfnComponent]
+    ) -> CfnImage:
+        component_arns = [
+            self._managed_arn(
+                "component", IncredibuildImageStack.CLOUDWATCH_AGENT_COMPONENT_NAME
+            ),
+            *[component.attr_arn for component in components],
+        ]
+
+        recipe = CfnImageRecipe(
+            self,
+            f"{name}Recipe",
+            name=name,
+            parent_image=parent_image,
+            version=self._content_version(
+                parent_image,
+                IncredibuildImageStack.CLOUDWATCH_AGENT_COMPONENT_NAME,
+                *[component.version for component in components],
+            ),
+            components=[
+                CfnImageRecipe.ComponentConfigurationProperty(component_arn=arn)
+                for arn in component_arns
+            ],
+        )
+
+        # A new recipe version replaces the image, which builds a new AMI
+        image = CfnImage(
+            self,
+            f"{name}Image",
+            image_recipe_arn=recipe.attr_arn,
+            infrastructure_configuration_arn=self._infrastructure_configuration.attr_arn,
+        )
+        Tags.of(image).add("Name", name)
+        return image
+
+    def _content_version(self, *parts: str) -> str:
+        # Image Builder versions are immutable, so a change in content has to come with
+        # a new version. We derive the patch number from the content, leaving out
+        # tokens (such as the asset bucket name) which don't change between deploys,
+        # but whose placeholders may change between synths
+        content = IncredibuildImageStack.TOKEN_PATTERN.sub(
+            "", "\n".join([self._revision, *parts])
+        )
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return f"1.0.{int(digest[:7], 16)}"
+
+    def _managed_arn(self, resource_type: str, name: str) -> str:
+        stack = Stack.of(self)
+        return f"arn:{stack.partition}:imagebuilder:{stack.region}:aws:{resource_type}/{name}"
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import List
+
+from aws_cdk import Stack
+from aws_cdk.aws_ec2 import UserData
+from aws_cdk.aws_iam import IGrantable
+from aws_cdk.aws_s3_assets import Asset
+
+from constructs import Construct
+
+sys.path.append("../../utils")
+from utils.discovery_snapshot import DiscoverySnapshot
+
+
+class IncredibuildInstaller(Construct):
+    """
+    Stages the Incredibuild silent installer as an S3 asset in the stack's region.
+
+    The installer is downloaded once per machine running the CDK and cached, so
+    instances fetch it from S3 (over the VPC's S3 gateway endpoint, if it has one)
+    instead of from the Internet, and check its SHA-256 before running it. The
+    installer isn't versioned, so its expected SHA-256 must be set in
+    INCREDIBUILD_INSTALLER_SHA256, and every copy (downloaded, cached or provided) is
+    checked against it before it's staged.
+    """
+
+    CACHE_PATH = Path.home().joinpath(".cdk", "cache", "incredibuild")
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        *,
+        download_url: str,
+        search_path: Path,
+    ):
+        super().__init__(scope, construct_id)
+
+        self.file_name = download_url.rsplit("/", 1)[-1]
+
+        # The INCREDIBUILD_INSTALLER_SHA256 environment variable pins the installer
+        # that is staged, whichever way it's found
+        expected_sha256 = os.getenv("INCREDIBUILD_INSTALLER_SHA256", "").lower()
+        if not expected_sha256:
+            print(
+                f"ERROR: Please set INCREDIBUILD_INSTALLER_SHA256 to the SHA-256 of the Incredibuild installer ({download_url})"
+            )
+            sys.exit(1)
+        self.sha256 = expected_sha256
+
+        # You can set the INCREDIBUILD_INSTALLER_PATH environment variable to an
+        # installer you have already downloaded, or place it next to your license
+        installer_path = os.getenv("INCREDIBUILD_INSTALLER_PATH")
+        if installer_path:
+            installer_path = Path(installer_path)
+        elif search_path.joinpath(self.file_name).exists():
+            installer_path = search_path.joinpath(self.file_name)
+        else:
+            installer_path = self._download(download_url)
+
+        if not installer_path.is_file():
+            print(
+                f"ERROR: Couldn't find the Incredibuild installer at {installer_path}"
+            )
+            sys.exit(1)
+
+        sha256 = self._get_sha256(installer_path)
+        if sha256 != self.sha256:
+            print(
+                f"ERROR: The Incredibuild installer at {installer_path} has SHA-256 {sha256}, expected {self.sha256}"
+            )
+            sys.exit(1)
+
+        self.asset = Asset(self, "Installer", path=str(installer_path))
+
+    def download_commands(self, local_file: str) -> List[str]:
+        """PowerShell commands downloading the installer to local_file and verifying it"""
+        return [
+            f'New-Item -ItemType Directory -Force -Path (Split-Path "{local_file}") | Out-Null',
+            f'Read-S3Object -BucketName "{self.asset.s3_bucket_name}" -Key "{self.asset.s3_object_key}" -File "{local_file}" -Region {Stack.of(self).region} -ErrorAction Stop',
+            f'if ((Get-FileHash -Algorithm SHA256 -Path "{local_file}").Hash -ne "{self.sha256}") {{ throw "The Incredibuild installer at {local_file} failed its checksum" }}',
+        ]
+
+    def add_download_commands(
+        self, user_data: UserData, *, local_file: str, grantee: IGrantable
+    ) -> None:
+        self.asset.grant_read(grantee)
+        user_data.add_commands(*self.download_commands(local_file))
+
+    def _download(self, download_url: str) -> Path:
+        # A cached installer is reused only while it matches the expected SHA-256, so
+        # that a new release or a corrupted copy is downloaded again
+        installer_path = IncredibuildInstaller.CACHE_PATH.joinpath(self.file_name)
+        if installer_path.exists():
+            if self._get_sha256(installer_path) == self.sha256:
+                return installer_path
+            print(
+                f"The cached Incredibuild installer at {installer_path} doesn't match INCREDIBUILD_INSTALLER_SHA256, downloading it again"
+            )
+
+        # Replayed synths must not reach the Internet
+        snapshot = DiscoverySnapshot.from_environment()
+        if snapshot and snapshot.replaying:
+            print(
+                f"ERROR: The Incredibuild installer isn't cached in {installer_path.parent} and can't be downloaded while replaying a discovery snapshot. Set INCREDIBUILD_INSTALLER_PATH to a downloaded installer."
+            )
+            sys.exit(1)
+
+        print(f"Downloading the Incredibuild installer from {download_url}")
+        installer_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Download next to the cache, and only cache an installer that is complete and
+        # matches the expected SHA-256
+        with tempfile.NamedTemporaryFile(
+            dir=installer_path.parent, delete=False
+        ) as download_file:
+            try:
+                with urllib.request.urlopen(download_url) as response:
+                    shutil.copyfileobj(response, download_file)
+            except (urllib.error.URLError, OSError) as error:
+                download_file.close()
+                os.remove(download_file.name)
+                print(
+                    f"ERROR: Couldn't download the Incredibuild installer from {download_url}: {error}. Set INCREDIBUILD_INSTALLER_PATH to a downloaded installer."
+                )
+                sys.exit(1)
+
+        sha256 = self._get_sha256(Path(download_file.name))
+        if sha256 != self.sha256:
+            os.remove(download_file.name)
+            print(
+                f"ERROR: The Incredibuild installer downloaded from {download_url} has SHA-256 {sha256}, expected {self.sha256}"
+            )
+            sys.exit(1)
+        os.replace(download_file.name, installer_path)
+
+        return installer_path
+
+    @staticmethod
+    def _get_sha256(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as installer_file:
+            for chunk in iter(lambda: installer_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
@@ -0,0 +1,42 @@
+from aws_cdk import Duration
+from aws_cdk.aws_cloudwatch import Metric
+
+# Build demand and capacity, as seen by the Incredibuild coordinator. The metrics are
+# published every minute by the exporter running on the coordinator
+INCREDIBUILD_METRICS_NAMESPACE = "NimbleStudio/Incredibuild"
+
+# Agents connected to the coordinator, including workstations
+CONNECTED_AGENTS = "ConnectedAgents"
+
+# Cores that connected helpers offer to builds
+AVAILABLE_HELPER_CORES = "AvailableHelperCores"
+
+# Cores of connected helpers that are running build tasks
+BUSY_HELPER_CORES = "BusyHelperCores"
+
+# Cores requested by running builds that no helper is currently serving
+QUEUED_HELPER_CORES = "QueuedHelperCores"
+
+# Percentage of the cores of connected helpers that are running build tasks
+HELPER_CORE_UTILIZATION = "HelperCoreUtilization"
+
+# Builds being run, and builds waiting for the coordinator to start them
+RUNNING_BUILDS = "RunningBuilds"
+QUEUED_BUILDS = "QueuedBuilds"
+
+# Helper cores allowed by the Incredibuild license
+LICENSED_HELPER_CORES = "LicensedHelperCores"
+
+
+def incredibuild_metric(
+    metric_name: str,
+    *,
+    statistic: str = "Maximum",
+    period: Duration = Duration.minutes(1),
+) -> Metric:
+    return Metric(
+        namespace=INCREDIBUILD_METRICS_NAMESPACE,
+        metric_name=metric_name,
+        statistic=statistic,
+        period=period,
+    )
@@ -0,0 +1,215 @@
+import json
+import re
+import sys
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Set, Tuple
+
+from dateutil import tz
+
+# Capacities a window can set on the worker fleet
+CAPACITY_KEYS = ("min_capacity", "max_capacity", "desired_capacity")
+
+WINDOW_NAME_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9]*$")
+
+DEFAULT_TIME_ZONE = "UTC"
+
+MONTH_NAMES = tuple("JAN FEB MAR APR MAY JUN JUL AUG SEP OCT NOV DEC".split())
+DAY_NAMES = ("SUN", "MON", "TUE", "WED", "THU", "FRI", "SAT")
+
+# Windows are checked for overlaps over two years of their schedules, leap day
+# included
+OVERLAP_CHECK_START = date(2024, 1, 1)
+OVERLAP_CHECK_DAYS = 731
+
+
+def load_worker_schedule(path: Path) -> List[Dict[str, Any]]:
+    """
+    Loads the scheduled capacity windows of the Incredibuild worker fleet.
+
+    The file is a JSON object with an optional default 'time_zone' and a list of
+    'windows'. Each window has a 'name', a 'start' and optionally an 'end' cron
+    expression (e.g. '0 8 * * MON-FRI'), an optional 'time_zone', and at least one of
+    'min_capacity', 'max_capacity' and 'desired_capacity' to apply at its start.
+    Windows can't overlap, since the end of a window resets the fleet's capacity.
+    The windows are returned with their time zone filled in.
+    """
+    try:
+        with open(path, "r") as schedule_file:
+            schedule = json.load(schedule_file)
+    except (OSError, ValueError) as e:
+        _schedule_error(path, f"Unable to read the schedule: {e}")
+
+    default_time_zone = schedule.get("time_zone", DEFAULT_TIME_ZONE)
+
+    windows = []
+    for window in schedule.get("windows", []):
+        name = window.get("name", "")
+        if not WINDOW_NAME_PATTERN.match(name):
+            _schedule_error(path, f"Window name '{name}' must be alphanumeric")
+        if name in (existing["name"] for existing in windows):
+            _schedule_error(path, f"Window '{name}' is defined more than once")
+
+        for key in ("start", "end"):
+            if key in window and len(window[key].split()) != 5:
+                _schedule_error(
+                    path,
+                    f"The {key} of window '{name}' must be a cron expression with 5 fields",
+                )
+        if "start" not in window:
+            _schedule_error(path, f"Window '{name}' has no start")
+
+        capacities = {key: window[key] for key in CAPACITY_KEYS if key in window}
+        if not capacities:
+            _schedule_error(
+                path,
+                f"Window '{name}' must set at least one of {', '.join(CAPACITY_KEYS)}",
+            )
+        # JSON booleans are ints to Python, but never a capacity
+        if any(
+            not isinstance(value, int) or isinstance(value, bool) or value < 0
+            for value in capacities.values()
+        ):
+            _schedule_error(
+                path, f"Capacities of window '{name}' must be non-negative integers"
+            )
+
+        min_capacity = capacities.get("min_capacity", 0)
+        max_capacity = capacities.get("max_capacity")
+        desired_capacity = capacities.get("desired_capacity", min_capacity)
+        if max_capacity is not None and not (
+            min_capacity <= desired_capacity <= max_capacity
+        ):
+            _schedule_error(
+                path,
+                f"Window '{name}' must have min_capacity <= desired_capacity <= max_capacity",
+            )
+
+        windows.append(
+            {
+                "name": name,
+                "start": window["start"],
+                "end": window.get("end"),
+                "time_zone": window.get("time_zone", default_time_zone),
+                **capacities,
+            }
+        )
+
+    _check_overlaps(path, windows)
+
+    return windows
+
+
+def _check_overlaps(path: Path, windows: List[Dict[str, Any]]):
+    # The end of a window resets the fleet's minimum and maximum, so it would undo
+    # any window that is still running. A window can't start while another one is
+    # running, nor at the same time as it ends, since actions scheduled at the same
+    # time run in no particular order
+    starts = {window["name"]: _fire_times(path, window, "start") for window in windows}
+    for window in windows:
+        if not window["end"]:
+            continue
+        ends = _fire_times(path, window, "end")
+        for start in starts[window["name"]]:
+            next_end = bisect_left(ends, start)
+            if next_end == len(ends):
+                continue
+            for other in windows:
+                if other is window:
+                    continue
+                other_starts = starts[other["name"]]
+                other_start = bisect_left(other_starts, start)
+                if (
+                    other_start < len(other_starts)
+                    and other_starts[other_start] <= ends[next_end]
+                ):
+                    _schedule_error(
+                        path,
+                        f"Window '{other['name']}' starts on {other_starts[other_start]:%Y-%m-%d %H:%M} UTC, while window '{window['name']}' is running",
+                    )
+
+
+def _fire_times(path: Path, window: Dict[str, Any], key: str) -> List[datetime]:
+    """Returns the UTC times at which the window's start or end fires, sorted"""
+    time_zone = tz.gettz(window["time_zone"])
+    if time_zone is None:
+        _schedule_error(
+            path,
+            f"Unknown time zone '{window['time_zone']}' for window '{window['name']}'",
+        )
+
+    fields = window[key].split()
+    try:
+        minutes, _ = _cron_values(fields[0], 0, 59)
+        hours, _ = _cron_values(fields[1], 0, 23)
+        days, any_day = _cron_values(fields[2], 1, 31)
+        months, _ = _cron_values(fields[3], 1, 12, MONTH_NAMES, 1)
+        weekdays, any_weekday = _cron_values(fields[4], 0, 7, DAY_NAMES)
+    except ValueError as e:
+        _schedule_error(path, f"The {key} of window '{window['name']}' is invalid: {e}")
+    # Sunday is both 0 and 7
+    weekdays = {weekday % 7 for weekday in weekdays}
+
+    fire_times = []
+    for offset in range(OVERLAP_CHECK_DAYS):
+        day = OVERLAP_CHECK_START + timedelta(days=offset)
+        if day.month not in months:
+            continue
+        # As in cron, a day matches either field when both are restricted
+        day_matches = day.day in days
+        weekday_matches = (day.weekday() + 1) % 7 in weekdays
+        if any_day or any_weekday:
+            matches = day_matches and weekday_matches
+        else:
+            matches = day_matches or weekday_matches
+        if not matches:
+            continue
+
+        for hour in sorted(hours):
+            for minute in sorted(minutes):
+                local_time = datetime(
+                    day.year, day.month, day.day, hour, minute, tzinfo=time_zone
+                )
+                fire_times.append(local_time.astimezone(tz.UTC).replace(tzinfo=None))
+
+    return sorted(fire_times)
+
+
+def _cron_values(
+    field: str, low: int, high: int, names: Tuple[str, ...] = (), first: int = 0
+) -> Tuple[Set[int], bool]:
+    """
+    Returns the values matched by a cron field, and whether it is unrestricted, which
+    as in cron is any field starting with '*' (so '*/2' is unrestricted too). Raises
+    ValueError if the field is invalid.
+    """
+
+    def value(text: str) -> int:
+        if text.upper() in names:
+            return names.index(text.upper()) + first
+        number = int(text)
+        if not low <= number <= high:
+            raise ValueError(f"{number} is not between {low} and {high}")
+        return number
+
+    values = set()
+    for part in field.split(","):
+        base, _, step = part.partition("/")
+        if base in ("*", "?"):
+            range_low, range_high = low, high
+        elif "-" in base:
+            range_low, range_high = (value(bound) for bound in base.split("-", 1))
+            if range_low > range_high:
+                raise ValueError(f"{base} is not an increasing range")
+        else:
+            range_low = value(base)
+            range_high = high if step else range_low
+        values.update(range(range_low, range_high + 1, int(step) if step else 1))
+
+    return values, field.startswith(("*", "?"))
+
+
+def _schedule_error(path: Path, message: str):
+    print(f"ERROR: Invalid Incredibuild worker schedule {path}. {message}.")
+    sys.exit(1)
@@ -1,18 +1,33 @@
 import json
 import os
-from typing import List
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
 
-from aws_cdk.aws_autoscaling import AutoScalingGroup
+from aws_cdk.aws_autoscaling import (
+    AdjustmentType,
+    AutoScalingGroup,
+    DefaultResult,
+    InstancesDistribution,
+    LaunchTemplateOverrides,
+    LifecycleTransition,
+    MixedInstancesPolicy,
+    OnDemandAllocationStrategy,
+    PoolState,
+    ScalingInterval,
+    Schedule,
+    SpotAllocationStrategy,
+)
 
 from aws_cdk import (
+    Duration,
     Stack,
     Tags,
 )
 
 from aws_cdk.aws_ec2 import (
-    InstanceClass,
-    InstanceSize,
     InstanceType,
+    LaunchTemplate,
     MachineImage,
     Port,
     SecurityGroup,
@@ -23,16 +38,84 @@ from aws_cdk.aws_ec2 import (
     WindowsVersion,
 )
 
-from aws_cdk.aws_iam import ManagedPolicy, Role, ServicePrincipal
+from aws_cdk.aws_iam import (
+    ManagedPolicy,
+    Policy,
+    PolicyStatement,
+    Role,
+    ServicePrincipal,
+)
 from aws_cdk.aws_s3_assets import Asset
 from aws_cdk.aws_ssm import StringParameter
+from aws_cdk.custom_resources import (
+    AwsCustomResource,
+    AwsCustomResourcePolicy,
+    AwsSdkCall,
+    PhysicalResourceId,
+)
 
 from constructs import Construct
 
-from nimblestudio.utils import add_user_data_cloudwatch_agent, is_valid_instance_type
+from nimblestudio.constructs.incredibuild_installer import IncredibuildInstaller
+from nimblestudio.constructs.incredibuild_metrics import (
+    HELPER_CORE_UTILIZATION,
+    QUEUED_HELPER_CORES,
+    incredibuild_metric,
+)
+from nimblestudio.utils import (
+    add_user_data_cloudwatch_agent,
+    add_user_data_scheduled_script,
+    get_cloudwatch_agent_metrics_config,
+    get_instance_type_baseline_bandwidth,
+    get_instance_type_offerings,
+    get_instance_type_vcpus,
+    is_valid_instance_type,
+    prefetch_instance_types,
+    supports_ena,
+    supports_placement_strategy,
+)
+
+sys.path.append("../../utils")
+from utils.user_data import UserDataTemplate
+
+ASSETS_PATH = Path(__file__).parent.parent.parent.joinpath("assets")
 
 
 class IncredibuildWorkers(Construct):
+    # Compute optimized types with 16 vCPUs, so that every worker contributes the same
+    # number of helper cores
+    DEFAULT_WORKER_INSTANCE_TYPES = (
+        "c5n.4xlarge",
+        "c5.4xlarge",
+        "c5a.4xlarge",
+        "c6i.4xlarge",
+        "c6a.4xlarge",
+    )
+    DEFAULT_MAX_CAPACITY = 40
+
+    INCREDIBUILD_INSTALL_PATH = r"C:\Program Files (x86)\IncrediBuild"
+    AGENT_READY_HOOK_NAME = "IncredibuildAgentReady"
+    DRAIN_HOOK_NAME = "IncredibuildAgentDrain"
+    DRAIN_AGENT_LOCAL_PATH = r"C:\temp\incredibuild-drain-agent.ps1"
+    DRAIN_AGENT_TASK_NAME = "IncredibuildDrainAgent"
+    DEFAULT_DRAIN_TIMEOUT_MINUTES = 10
+
+    # Processes of the Incredibuild agent, whose CPU, memory and I/O are collected
+    PROCESS_PATTERNS = ["BuildService"]
+
+    # The ports Incredibuild agents accept build tasks on
+    INCREDIBUILD_HELPER_PORTS = (31105, 31200)
+
+    # Keep helpers busy, but leave headroom for bursts of build tasks
+    TARGET_CPU_UTILIZATION_PERCENT = 60
+
+    # Helpers are only removed after their cores have been mostly idle for this long
+    SCALE_IN_IDLE_PERIOD = Duration.minutes(15)
+    SCALE_IN_UTILIZATION_PERCENT = 20
+
+    # Keep most of the fleet in service while workers are replaced with a new AMI
+    INSTANCE_REFRESH_MIN_HEALTHY_PERCENT = 90
+
     def __init__(
         self,
         scope: Construct,
@@ -40,9 +123,12 @@ class IncredibuildWorkers(Construct):
         *,
         incredibuild_coordinator_domain_name: str,
         incredibuild_coordinator_security_group: SecurityGroup,
-        incredibuild_installer_location: str,
+        incredibuild_installer: IncredibuildInstaller,
         vpc: str,
         vpc_endpoints_sg: SecurityGroup,
+        placement_group_name: str = None,
+        schedule_windows: List[Dict[str, Any]] = None,
+        worker_image_id: str = None,
         worker_subnets: List[Subnet],
         workstations_security_group: SecurityGroup,
     ):
@@ -89,6 +175,13 @@ class IncredibuildWorkers(Construct):
             ],
             role_name="IncredibuildWorkersRole",
         )
+        # Workers look up their Auto Scaling Group, which can't be scoped to a resource
+        workers_role.add_to_policy(
+            PolicyStatement(
+                actions=["autoscaling:DescribeAutoScalingInstances"],
+                resources=["*"],
+            )
+        )
 
         # Configure UserData to configure CloudWatch, download Incredibuild, and then
         # configure the workers to connect to the Incredibuild coordinator automatically
@@ -96,16 +189,28 @@ class IncredibuildWorkers(Construct):
         self._add_user_data_cloudwatch_agent(coordinator_instance_role=workers_role)
         self._add_incredibuild_installer_user_data(
             coordinator_domain_name=incredibuild_coordinator_domain_name,
-            incredibuild_installer_location=incredibuild_installer_location,
+            incredibuild_installer=incredibuild_installer,
+            workers_role=workers_role,
+        )
+        # You can set the WORKER_DRAIN_TIMEOUT_MINUTES environment variable to how long
+        # a worker leaving service may wait for its build tasks to finish
+        drain_timeout_minutes = int(
+            os.getenv(
+                "WORKER_DRAIN_TIMEOUT_MINUTES",
+                IncredibuildWorkers.DEFAULT_DRAIN_TIMEOUT_MINUTES,
+            )
         )
+        self._add_drain_agent_user_data(drain_timeout_minutes=drain_timeout_minutes)
+        self._add_agent_ready_user_data()
 
         user_data = UserData.custom("<persist>true</persist>")
         user_data.add_commands(self._user_data.render())
 
         # You can set the WORKER_AMI environment variable to the id of an AMI that will
         # be used by Incredibuild workers. This AMI may have Visual Studio installed,
-        # and any other software you want Incredibuild to use
-        worker_ami = os.getenv("WORKER_AMI")
+        # and any other software you want Incredibuild to use. A golden AMI, baked
+        # from it with the agent installed, takes precedence
+        worker_ami = worker_image_id or os.getenv("WORKER_AMI")
         worker_machine_image = (
             MachineImage.generic_windows(
                 {
@@ -116,36 +221,385 @@ class IncredibuildWorkers(Construct):
             else WindowsImage(WindowsVersion.WINDOWS_SERVER_2022_ENGLISH_FULL_BASE)
         )
 
-        # Use the instance type specified in the WORKER_INSTANCE_TYPE environment
-        # variable if possible, otherwise default to c5.xlarge4
-        specified_worker_instance_type = os.getenv("WORKER_INSTANCE_TYPE")
-        worker_instance_type = (
-            InstanceType(specified_worker_instance_type)
-            if specified_worker_instance_type
-            and is_valid_instance_type(specified_worker_instance_type)
-            else InstanceType.of(
-                InstanceClass.COMPUTE5_HIGH_PERFORMANCE, InstanceSize.XLARGE4
-            )
+        # You can set the WORKER_WARM_POOL_SIZE environment variable to keep that many
+        # stopped workers with the agent already installed, ready to start in seconds.
+        # Warm pools can't be used with Spot or mixed instance types, so a fleet with
+        # a warm pool runs On-Demand on the first worker instance type
+        warm_pool_size = int(os.getenv("WORKER_WARM_POOL_SIZE", "0"))
+
+        worker_instance_types = self._get_worker_instance_types(
+            cluster_placement=bool(placement_group_name)
+        )
+        if warm_pool_size:
+            worker_instance_types = worker_instance_types[:1]
+
+        on_demand_base_capacity = int(os.getenv("WORKER_ON_DEMAND_BASE_CAPACITY", "0"))
+        on_demand_percentage = int(os.getenv("WORKER_ON_DEMAND_PERCENTAGE", "0"))
+        worker_subnets = self._get_worker_subnets(
+            worker_subnets,
+            worker_instance_types=worker_instance_types,
+            on_demand=bool(warm_pool_size) or on_demand_percentage >= 100,
+        )
+
+        worker_vcpus = {
+            instance_type: get_instance_type_vcpus(instance_type)
+            for instance_type in worker_instance_types
+        }
+
+        launch_template = LaunchTemplate(
+            self,
+            "IncredibuildWorkerLaunchTemplate",
+            instance_type=InstanceType(worker_instance_types[0]),
+            machine_image=worker_machine_image,
+            role=workers_role,
+            security_group=incredibuild_workers_security_group,
+            user_data=user_data,
         )
 
+        if warm_pool_size:
+            fleet_capacity = {"launch_template": launch_template}
+        else:
+            # Workers run on Spot capacity from whichever of the instance types has the
+            # most of it available, with an optional share of On-Demand workers
+            fleet_capacity = {
+                "mixed_instances_policy": MixedInstancesPolicy(
+                    launch_template=launch_template,
+                    launch_template_overrides=[
+                        LaunchTemplateOverrides(
+                            instance_type=InstanceType(instance_type)
+                        )
+                        for instance_type in worker_instance_types
+                    ],
+                    instances_distribution=InstancesDistribution(
+                        on_demand_allocation_strategy=OnDemandAllocationStrategy.PRIORITIZED,
+                        on_demand_base_capacity=on_demand_base_capacity,
+                        on_demand_percentage_above_base_capacity=on_demand_percentage,
+                        spot_allocation_strategy=SpotAllocationStrategy.CAPACITY_OPTIMIZED,
+                    ),
+                ),
+                # Replace Spot workers proactively when they are at risk of interruption
+                "capacity_rebalance": True,
+            }
+
+        max_capacity = self._get_max_capacity(max(worker_vcpus.values()))
+
         # Create an ASG that can help speed up Incredibuild build jobs even when there
         # are no other Workstations available
         self.incredibuild_workers = AutoScalingGroup(
             self,
             "IncredibuildWorkerFleet",
-            instance_type=worker_instance_type,
-            machine_image=worker_machine_image,
             min_capacity=0,
-            max_capacity=40,
-            role=workers_role,
-            security_group=incredibuild_workers_security_group,
-            user_data=user_data,
+            max_capacity=max_capacity,
             vpc=vpc,
             vpc_subnets=SubnetSelection(subnets=worker_subnets),
+            **fleet_capacity,
+        )
+
+        self.incredibuild_workers.add_lifecycle_hook(
+            "IncredibuildAgentReadyHook",
+            lifecycle_hook_name=IncredibuildWorkers.AGENT_READY_HOOK_NAME,
+            lifecycle_transition=LifecycleTransition.INSTANCE_LAUNCHING,
+            heartbeat_timeout=Duration.minutes(30),
+            default_result=DefaultResult.ABANDON,
+        )
+
+        # Workers leaving service wait for the drain agent to let their build tasks
+        # finish, and are terminated anyway once the drain has had its chance
+        self.incredibuild_workers.add_lifecycle_hook(
+            "IncredibuildAgentDrainHook",
+            lifecycle_hook_name=IncredibuildWorkers.DRAIN_HOOK_NAME,
+            lifecycle_transition=LifecycleTransition.INSTANCE_TERMINATING,
+            heartbeat_timeout=Duration.minutes(drain_timeout_minutes + 5),
+            default_result=DefaultResult.CONTINUE,
+        )
+
+        # Workers complete the lifecycle actions of their own fleet only. This is a
+        # policy of its own, since the launch template depends on the role's default
+        # policy, which can't then refer to the fleet
+        Policy(
+            self,
+            "IncredibuildWorkersLifecyclePolicy",
+            roles=[workers_role],
+            statements=[
+                PolicyStatement(
+                    actions=["autoscaling:CompleteLifecycleAction"],
+                    resources=[self.incredibuild_workers.auto_scaling_group_arn],
+                )
+            ],
         )
 
+        if warm_pool_size:
+            self.incredibuild_workers.add_warm_pool(
+                min_size=warm_pool_size,
+                max_group_prepared_capacity=warm_pool_size,
+                pool_state=PoolState.STOPPED,
+                reuse_on_scale_in=True,
+            )
+
+        # Workers in a cluster placement group share a low latency, high bandwidth
+        # network with the coordinator, which speeds up dispatching build tasks and
+        # transferring their inputs
+        if placement_group_name:
+            self.incredibuild_workers.node.default_child.placement_group = (
+                placement_group_name
+            )
+
         Tags.of(self.incredibuild_workers).add("Name", "Incredibuild Worker")
 
+        self._add_scaling_policies(worker_vcpus=min(worker_vcpus.values()))
+
+        if schedule_windows:
+            self._add_scheduled_scaling(
+                schedule_windows=schedule_windows, max_capacity=max_capacity
+            )
+
+        if worker_image_id:
+            self._add_instance_refresh(worker_image_id=worker_image_id)
+
+    def _get_worker_subnets(
+        self,
+        worker_subnets: List[Subnet],
+        *,
+        worker_instance_types: List[str],
+        on_demand: bool,
+    ) -> List[Subnet]:
+        # Local zones (named after their region, e.g. 'us-west-2-lax-1a') offer few
+        # instance types and hardly any Spot capacity. An Auto Scaling Group keeps
+        # retrying, and rebalancing into, zones it can't launch in, so workers only
+        # use the local zones that offer their instance types, and only On-Demand
+        region = Stack.of(self).region
+        local_zones = sorted(
+            {
+                subnet.availability_zone
+                for subnet in worker_subnets
+                if subnet.availability_zone.startswith(f"{region}-")
+            }
+        )
+        if not local_zones:
+            return worker_subnets
+
+        if on_demand:
+            offerings = get_instance_type_offerings(local_zones, worker_instance_types)
+            skipped_zones = [zone for zone in local_zones if not offerings[zone]]
+            reason = f"they offer none of the worker instance types ({', '.join(worker_instance_types)})"
+        else:
+            skipped_zones = local_zones
+            reason = "workers run on Spot capacity, which local zones rarely offer. Set WORKER_ON_DEMAND_PERCENTAGE to 100 to run workers in local zones On-Demand"
+
+        if skipped_zones:
+            print(
+                f"WARNING: Incredibuild workers won't be launched in the local zones {', '.join(skipped_zones)}, as {reason}."
+            )
+        worker_subnets = [
+            subnet
+            for subnet in worker_subnets
+            if subnet.availability_zone not in skipped_zones
+        ]
+        if not worker_subnets:
+            print("ERROR: Incredibuild workers have no subnet left to launch in.")
+            sys.exit(1)
+        return worker_subnets
+
+    def _get_worker_instance_types(self, *, cluster_placement: bool) -> List[str]:
+        # Use the instance type specified in the WORKER_INSTANCE_TYPE environment
+        # variable first if possible, followed by the comma separated alternatives in
+        # WORKER_INSTANCE_TYPES (or our default compute optimized types)
+        specified_worker_instance_type = os.getenv("WORKER_INSTANCE_TYPE")
+        specified_worker_instance_types = os.getenv("WORKER_INSTANCE_TYPES")
+
+        # A single WORKER_INSTANCE_TYPE on its own pins the fleet to that type
+        instance_types = [specified_worker_instance_type]
+        if specified_worker_instance_types:
+            instance_types.extend(
+                instance_type.strip()
+                for instance_type in specified_worker_instance_types.split(",")
+            )
+        elif not specified_worker_instance_type:
+            instance_types.extend(IncredibuildWorkers.DEFAULT_WORKER_INSTANCE_TYPES)
+
+        instance_types = list(dict.fromkeys(filter(None, instance_types)))
+        prefetch_instance_types(instance_types)
+
+        worker_instance_types = []
+        for instance_type in instance_types:
+            if not is_valid_instance_type(instance_type):
+                continue
+            if self._is_suitable_worker_instance_type(
+                instance_type, cluster_placement=cluster_placement
+            ):
+                worker_instance_types.append(instance_type)
+
+        if not worker_instance_types:
+            print(
+                f"ERROR: None of the worker instance types {', '.join(instance_types)} are suitable for Incredibuild workers."
+            )
+            sys.exit(1)
+
+        return worker_instance_types
+
+    def _is_suitable_worker_instance_type(
+        self, instance_type: str, *, cluster_placement: bool
+    ) -> bool:
+        # Build tasks and their inputs are sent to workers over the network, so we only
+        # use instance types with enhanced networking
+        if not supports_ena(instance_type):
+            print(f"{instance_type} doesn't support enhanced networking (ENA).")
+            return False
+
+        if cluster_placement and not supports_placement_strategy(
+            instance_type, "cluster"
+        ):
+            print(f"{instance_type} can't be launched in a cluster placement group.")
+            return False
+
+        # You can set the WORKER_MIN_BASELINE_BANDWIDTH_GBPS environment variable to
+        # only use instance types that sustain at least that much network bandwidth
+        min_baseline_bandwidth = float(
+            os.getenv("WORKER_MIN_BASELINE_BANDWIDTH_GBPS", "0")
+        )
+        baseline_bandwidth = get_instance_type_baseline_bandwidth(instance_type)
+        if baseline_bandwidth < min_baseline_bandwidth:
+            print(
+                f"{instance_type} has a baseline bandwidth of {baseline_bandwidth} Gbps, less than {min_baseline_bandwidth} Gbps."
+            )
+            return False
+
+        return True
+
+    def _get_max_capacity(self, worker_vcpus: int) -> int:
+        # You can set the INCREDIBUILD_LICENSED_CORES environment variable to the
+        # number of helper cores your Incredibuild license allows, so that the fleet
+        # never grows beyond what the coordinator can put to use
+        licensed_cores = os.getenv("INCREDIBUILD_LICENSED_CORES")
+        if not licensed_cores:
+            return IncredibuildWorkers.DEFAULT_MAX_CAPACITY
+
+        return max(1, int(licensed_cores) // worker_vcpus)
+
+    def _add_scaling_policies(self, *, worker_vcpus: int) -> None:
+        # Scale out aggressively as soon as builds are waiting for helper cores, adding
+        # more workers the more cores are queued
+        self.incredibuild_workers.scale_on_metric(
+            "QueuedHelperCoresScaling",
+            metric=incredibuild_metric(QUEUED_HELPER_CORES),
+            adjustment_type=AdjustmentType.CHANGE_IN_CAPACITY,
+            evaluation_periods=1,
+            scaling_steps=[
+                ScalingInterval(upper=1, change=0),
+                ScalingInterval(lower=1, change=+2),
+                ScalingInterval(lower=4 * worker_vcpus, change=+5),
+                ScalingInterval(lower=10 * worker_vcpus, change=+10),
+            ],
+            estimated_instance_warmup=Duration.minutes(5),
+        )
+
+        # Scale in conservatively, one worker at a time, once helper cores have been
+        # mostly idle for a while
+        self.incredibuild_workers.scale_on_metric(
+            "HelperCoreUtilizationScaling",
+            metric=incredibuild_metric(HELPER_CORE_UTILIZATION, statistic="Average"),
+            adjustment_type=AdjustmentType.CHANGE_IN_CAPACITY,
+            evaluation_periods=int(
+                IncredibuildWorkers.SCALE_IN_IDLE_PERIOD.to_minutes()
+            ),
+            scaling_steps=[
+                ScalingInterval(
+                    upper=IncredibuildWorkers.SCALE_IN_UTILIZATION_PERCENT, change=-1
+                ),
+                ScalingInterval(
+                    lower=IncredibuildWorkers.SCALE_IN_UTILIZATION_PERCENT, change=0
+                ),
+            ],
+        )
+
+        # CPU keeps the fleet sized for the load of the helpers that are already
+        # building. It only scales out, since idle workers between builds would
+        # otherwise be scaled in without waiting for the helper core policy above
+        self.incredibuild_workers.scale_on_cpu_utilization(
+            "CpuUtilizationScaling",
+            target_utilization_percent=IncredibuildWorkers.TARGET_CPU_UTILIZATION_PERCENT,
+            disable_scale_in=True,
+            estimated_instance_warmup=Duration.minutes(5),
+        )
+
+    def _add_scheduled_scaling(
+        self, *, schedule_windows: List[Dict[str, Any]], max_capacity: int
+    ) -> None:
+        # Each window sets the fleet's capacity when it starts, so that workers are
+        # already running when the builds come in. When it ends, the minimum and
+        # maximum go back to the fleet's defaults, and the scaling policies take the
+        # desired capacity back down as the builds wind down
+        for window in schedule_windows:
+            window_max_capacity = window.get("max_capacity", max_capacity)
+            # A window can't take the fleet beyond what the license allows
+            if window_max_capacity > max_capacity:
+                print(
+                    f"ERROR: Worker schedule window '{window['name']}' has a max_capacity of {window_max_capacity}, more than the fleet's maximum of {max_capacity}."
+                )
+                sys.exit(1)
+
+            window_capacity = max(
+                window.get("min_capacity", 0), window.get("desired_capacity", 0)
+            )
+            if window_capacity > window_max_capacity:
+                print(
+                    f"ERROR: Worker schedule window '{window['name']}' asks for {window_capacity} workers, more than its maximum of {window_max_capacity}."
+                )
+                sys.exit(1)
+
+            self.incredibuild_workers.scale_on_schedule(
+                f"{window['name']}Start",
+                schedule=Schedule.expression(window["start"]),
+                time_zone=window["time_zone"],
+                min_capacity=window.get("min_capacity"),
+                max_capacity=window.get("max_capacity"),
+                desired_capacity=window.get("desired_capacity"),
+            )
+
+            if window["end"]:
+                self.incredibuild_workers.scale_on_schedule(
+                    f"{window['name']}End",
+                    schedule=Schedule.expression(window["end"]),
+                    time_zone=window["time_zone"],
+                    min_capacity=0,
+                    max_capacity=max_capacity,
+                )
+
+    def _add_instance_refresh(self, *, worker_image_id: str) -> None:
+        # New workers pick up a new golden AMI from the launch template, and an instance
+        # refresh replaces the running and warm pool workers with it. The refresh is
+        # keyed on the AMI id, so it only starts when the AMI changes
+        start_instance_refresh = AwsSdkCall(
+            service="AutoScaling",
+            action="startInstanceRefresh",
+            parameters={
+                "AutoScalingGroupName": self.incredibuild_workers.auto_scaling_group_name,
+                "Preferences": {
+                    "MinHealthyPercentage": IncredibuildWorkers.INSTANCE_REFRESH_MIN_HEALTHY_PERCENT,
+                    "InstanceWarmup": 300,
+                },
+            },
+            physical_resource_id=PhysicalResourceId.of(worker_image_id),
+            # A refresh that is still rolling out an earlier AMI will carry on, and
+            # new workers are launched from the new AMI in the meantime
+            ignore_error_codes_matching="InstanceRefreshInProgress",
+        )
+
+        AwsCustomResource(
+            self,
+            "IncredibuildWorkerInstanceRefresh",
+            on_create=start_instance_refresh,
+            on_update=start_instance_refresh,
+            policy=AwsCustomResourcePolicy.from_statements(
+                [
+                    PolicyStatement(
+                        actions=["autoscaling:StartInstanceRefresh"],
+                        resources=[self.incredibuild_workers.auto_scaling_group_arn],
+                    )
+                ]
+            ),
+        )
+
     # Configure the CloudWatch agent so that we upload logs to CloudWatch
     def _add_user_data_cloudwatch_agent(self, coordinator_instance_role: Role) -> None:
         # Store the cloudwatch configuration in Parameter Store
@@ -171,18 +625,28 @@ class IncredibuildWorkers(Construct):
             string_value=json.dumps(cloudwatch_config),
         )
 
+        # Workers report their host metrics per Auto Scaling Group, so the fleet can be
+        # right-sized from how busy its instances are as a whole
+        metrics_config = get_cloudwatch_agent_metrics_config(
+            dimensions=["AutoScalingGroupName", "InstanceType"],
+            aggregation_dimensions=[["AutoScalingGroupName"]],
+            process_patterns=IncredibuildWorkers.PROCESS_PATTERNS,
+        )
+
         add_user_data_cloudwatch_agent(
             self,
             self._user_data,
             cloudwatch_ssm_param=cloudwatch_ssm_param,
             instance_role=coordinator_instance_role,
+            metrics_config=metrics_config,
         )
 
     def _add_incredibuild_installer_user_data(
         self,
         *,
         coordinator_domain_name: str,
-        incredibuild_installer_location: str,
+        incredibuild_installer: IncredibuildInstaller,
+        workers_role: Role,
     ) -> None:
 
         # Download the Incredibuild silent installer
@@ -192,11 +656,52 @@ class IncredibuildWorkers(Construct):
             f'if (-Not (Test-Path "C:\\temp")) {{ New-Item "C:\\temp" -ItemType Directory }}'
         )
 
+        # This script runs on every boot, and warm pool workers are started again
+        # after being prepared, so only install the agent once
+        self._user_data.add_commands(
+            f'if (-Not (Test-Path "{IncredibuildWorkers.INCREDIBUILD_INSTALL_PATH}")) {{'
+        )
+        incredibuild_installer.add_download_commands(
+            self._user_data,
+            local_file=incredibuild_installer_local_path,
+            grantee=workers_role,
+        )
         self._user_data.add_commands(
-            f'wget -Uri "{incredibuild_installer_location}" -Outfile "{incredibuild_installer_local_path}"'
+            # Install Incredibuild, and then configure it to connect to the coordinator
+            f'{incredibuild_installer_local_path} /install /Components=Agent /Coordinator="{coordinator_domain_name}"',
+            "}",
+        )
+
+    def _add_drain_agent_user_data(self, *, drain_timeout_minutes: int) -> None:
+        # The drain agent runs in the background from every boot, watching for the
+        # worker to be scaled in or reclaimed. It then stops accepting new build tasks,
+        # waits for the ones in flight, and lets the termination go ahead
+        first_port, last_port = IncredibuildWorkers.INCREDIBUILD_HELPER_PORTS
+        drain_agent = UserDataTemplate.load(
+            ASSETS_PATH.joinpath("incredibuild-drain-agent.ps1")
+        ).render(
+            {
+                "REGION_PLACEHOLDER": Stack.of(self).region,
+                "LIFECYCLE_HOOK_NAME_PLACEHOLDER": IncredibuildWorkers.DRAIN_HOOK_NAME,
+                "DRAIN_TIMEOUT_MINUTES_PLACEHOLDER": str(drain_timeout_minutes),
+                "HELPER_PORTS_PLACEHOLDER": f"{first_port}-{last_port}",
+            }
+        )
+
+        add_user_data_scheduled_script(
+            self._user_data,
+            local_path=IncredibuildWorkers.DRAIN_AGENT_LOCAL_PATH,
+            script=drain_agent,
+            task_name=IncredibuildWorkers.DRAIN_AGENT_TASK_NAME,
+            trigger="New-ScheduledTaskTrigger -AtStartup",
         )
 
-        # Install Incredibuild, and then configure it to connect to the coordinator
+    def _add_agent_ready_user_data(self) -> None:
+        # Tell the Auto Scaling Group that the agent is installed, so the worker
+        # enters service (or the warm pool) only once it can contribute cores
         self._user_data.add_commands(
-            f'{incredibuild_installer_local_path} /install /Components=Agent /Coordinator="{coordinator_domain_name}"'
+            '$token = Invoke-RestMethod -Method PUT -Uri "http://169.254.169.254/latest/api/token" -Headers @{"X-aws-ec2-metadata-token-ttl-seconds" = "300"}',
+            '$instanceId = Invoke-RestMethod -Uri "http://169.254.169.254/latest/meta-data/instance-id" -Headers @{"X-aws-ec2-metadata-token" = $token}',
+            f"$autoScalingGroupName = (Get-ASAutoScalingInstance -InstanceId $instanceId -Region {Stack.of(self).region}).AutoScalingGroupName",
+            f"Complete-ASLifecycleAction -AutoScalingGroupName $autoScalingGroupName -LifecycleHookName {IncredibuildWorkers.AGENT_READY_HOOK_NAME} -InstanceId $instanceId -LifecycleActionResult CONTINUE -Region {Stack.of(self).region}",
         )
@@ -1,33 +1,183 @@
+import json
+import os
+from typing import Dict, List
+
 from aws_cdk import Stack
 from aws_cdk.aws_ec2 import UserData
-from aws_cdk.aws_iam import Role
+from aws_cdk.aws_iam import ManagedPolicy, Role
 from aws_cdk.aws_s3 import Bucket
 from aws_cdk.aws_ssm import StringParameter
 
-import boto3
-from botocore import exceptions
+import sys
 
+sys.path.append("../../utils")
+from utils.config_retriever import get_config_retriever
 
-def is_valid_instance_type(instance_type: str):
-    client = boto3.client("ec2")
 
-    try:
-        client.describe_instance_types(InstanceTypes=[instance_type])
-    except exceptions.ClientError as e:
-        if e.response["Error"]["Code"] == "InvalidInstanceType":
-            print(f"{instance_type} is not a valid instance type.")
-            return False
+def is_valid_instance_type(instance_type: str):
+    # Instance type lookups go through the ConfigRetriever so they are cached and
+    # recorded along with the rest of the studio discovery
+    if get_config_retriever().get_instance_type_info(instance_type) is None:
+        print(f"{instance_type} is not a valid instance type.")
+        return False
 
     return True
 
 
+def prefetch_instance_types(instance_types: List[str]) -> None:
+    # Describes all of the instance types in one call, rather than one call each as
+    # they are looked up
+    get_config_retriever().get_instance_type_infos(instance_types)
+
+
+def get_instance_type_offerings(
+    zone_names: List[str], instance_types: List[str]
+) -> Dict[str, List[str]]:
+    # Which of the instance types each zone offers, in one call for all of them
+    return get_config_retriever().get_instance_type_offerings(
+        zone_names, instance_types
+    )
+
+
+def get_instance_type_vcpus(instance_type: str) -> int:
+    instance_type_info = get_config_retriever().get_instance_type_info(instance_type)
+    return instance_type_info["VCpuInfo"]["DefaultVCpus"]
+
+
+def supports_ena(instance_type: str) -> bool:
+    instance_type_info = get_config_retriever().get_instance_type_info(instance_type)
+    return instance_type_info["NetworkInfo"].get("EnaSupport") in (
+        "supported",
+        "required",
+    )
+
+
+def get_instance_type_baseline_bandwidth(instance_type: str) -> float:
+    # Bandwidth is reported per network card, in Gbps. Types that burst ('Up to 10
+    # Gigabit') can only sustain their baseline
+    instance_type_info = get_config_retriever().get_instance_type_info(instance_type)
+    return sum(
+        network_card.get("BaselineBandwidthInGbps", 0)
+        for network_card in instance_type_info["NetworkInfo"].get("NetworkCards", [])
+    )
+
+
+def supports_placement_strategy(instance_type: str, strategy: str) -> bool:
+    instance_type_info = get_config_retriever().get_instance_type_info(instance_type)
+    return strategy in instance_type_info.get("PlacementGroupInfo", {}).get(
+        "SupportedStrategies", []
+    )
+
+
+# Values the CloudWatch agent fills in for the dimensions it appends to host metrics
+CLOUDWATCH_AGENT_DIMENSIONS = {
+    "AutoScalingGroupName": "${aws:AutoScalingGroupName}",
+    "ImageId": "${aws:ImageId}",
+    "InstanceId": "${aws:InstanceId}",
+    "InstanceType": "${aws:InstanceType}",
+}
+
+DEFAULT_HOST_METRICS_INTERVAL_SECONDS = 60
+
+
+def get_cloudwatch_agent_metrics_config(
+    *,
+    dimensions: List[str],
+    aggregation_dimensions: List[List[str]] = (),
+    process_patterns: List[str] = (),
+) -> dict:
+    """
+    Builds a CloudWatch agent configuration collecting Windows host metrics: CPU per
+    core, memory, disk queue length and throughput, network bytes, and the CPU,
+    memory and I/O of the processes whose name matches one of process_patterns.
+
+    Metrics get the given dimensions (keys of CLOUDWATCH_AGENT_DIMENSIONS), and are
+    also aggregated over each of the aggregation_dimensions, e.g.
+    [["AutoScalingGroupName"]] for fleet-wide metrics.
+    """
+    # You can set the HOST_METRICS_INTERVAL_SECONDS environment variable to how often
+    # host metrics are collected
+    interval_seconds = int(
+        os.getenv(
+            "HOST_METRICS_INTERVAL_SECONDS", DEFAULT_HOST_METRICS_INTERVAL_SECONDS
+        )
+    )
+
+    metrics_collected = {
+        "Processor": {
+            "measurement": ["% Processor Time", "% User Time", "% Privileged Time"],
+            "resources": ["*"],
+        },
+        "Memory": {
+            "measurement": [
+                "% Committed Bytes In Use",
+                "Available MBytes",
+                "Pages/sec",
+            ],
+        },
+        "PhysicalDisk": {
+            "measurement": [
+                "Avg. Disk Queue Length",
+                "% Disk Time",
+                "Disk Read Bytes/sec",
+                "Disk Write Bytes/sec",
+            ],
+            "resources": ["*"],
+        },
+        "Network Interface": {
+            "measurement": ["Bytes Received/sec", "Bytes Sent/sec"],
+            "resources": ["*"],
+        },
+    }
+    if process_patterns:
+        metrics_collected["procstat"] = [
+            {
+                "exe": pattern,
+                "measurement": [
+                    "cpu_usage",
+                    "memory_rss",
+                    "read_bytes",
+                    "write_bytes",
+                    "num_threads",
+                ],
+            }
+            for pattern in process_patterns
+        ]
+
+    # The interval is set on each metric rather than in an agent section, which would
+    # conflict with the other configurations appended to the agent
+    for metric in metrics_collected.values():
+        for plugin in metric if isinstance(metric, list) else [metric]:
+            plugin["metrics_collection_interval"] = interval_seconds
+
+    return {
+        "metrics": {
+            "append_dimensions": {
+                dimension: CLOUDWATCH_AGENT_DIMENSIONS[dimension]
+                for dimension in dimensions
+            },
+            "aggregation_dimensions": [
+                list(aggregation) for aggregation in aggregation_dimensions
+            ],
+            "metrics_collected": metrics_collected,
+        },
+    }
+
+
 def add_user_data_cloudwatch_agent(
     stack: Stack,
     user_data: UserData,
     *,
     cloudwatch_ssm_param: StringParameter,
     instance_role: Role,
+    metrics_config: dict = None,
 ) -> None:
+    # The agent needs to ship logs and metrics, and to look up the dimensions it
+    # appends to metrics
+    instance_role.add_managed_policy(
+        ManagedPolicy.from_aws_managed_policy_name("CloudWatchAgentServerPolicy")
+    )
+
     # Firstly we need to give ourselves access to the CloudWatch agent s3 bucket
     cloudwatch_agent_bucket_name = f"amazoncloudwatch-agent-{Stack.of(stack).region}"
     cloudwatch_agent_bucket = Bucket.from_bucket_arn(
@@ -44,14 +194,49 @@ def add_user_data_cloudwatch_agent(
         r"C:\Program Files\Amazon\AmazonCloudWatchAgent\amazon-cloudwatch-agent-ctl.ps1"
     )
 
+    # The agent may already be installed by a golden AMI
+    user_data.add_commands(f'if (-Not (Test-Path "{cloudwatch_agent_ctl_path}")) {{')
     user_data.add_s3_download_command(
         bucket=cloudwatch_agent_bucket,
         bucket_key=cloudwatch_agent_bucket_key,
         local_file=cloudwatch_agent_installer_path,
     )
     user_data.add_commands(
-        f"Start-process msiexec -Wait -ArgumentList /i, {cloudwatch_agent_installer_path}"
+        f"Start-process msiexec -Wait -ArgumentList /i, {cloudwatch_agent_installer_path}",
+        "}",
     )
     user_data.add_commands(
         f'& "{cloudwatch_agent_ctl_path}" -a append-config -m ec2 -c ssm:{cloudwatch_ssm_param.parameter_name} -s'
     )
+
+    # Host metrics are kept in their own configuration, appended to the caller's
+    if metrics_config:
+        metrics_ssm_param = StringParameter(
+            stack,
+            "CloudWatchAgentMetricsConfig",
+            description="CloudWatch agent host metrics configuration",
+            string_value=json.dumps(metrics_config),
+        )
+        user_data.add_commands(
+            f'& "{cloudwatch_agent_ctl_path}" -a append-config -m ec2 -c ssm:{metrics_ssm_param.parameter_name} -s'
+        )
+
+
+def add_user_data_scheduled_script(
+    user_data: UserData,
+    *,
+    local_path: str,
+    script: str,
+    task_name: str,
+    trigger: str,
+) -> None:
+    # Write the script next to the other user data files, and run it as SYSTEM from a
+    # scheduled task. The trigger is a PowerShell expression creating the task trigger
+    user_data.add_commands(
+        "@'",
+        script,
+        f'\'@ | Set-Content -Path "{local_path}"',
+        f'$action = New-ScheduledTaskAction -Execute "powershell.exe" -Argument "-NoProfile -ExecutionPolicy Bypass -File {local_path}"',
+        f"Register-ScheduledTask -TaskName {task_name} -Action $action -Trigger ({trigger}) -User SYSTEM -RunLevel Highest -Force | Out-Null",
+        f"Start-ScheduledTask -TaskName {task_name}",
+    )
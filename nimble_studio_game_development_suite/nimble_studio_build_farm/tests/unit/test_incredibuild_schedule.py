@@ -0,0 +1,201 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from nimblestudio.constructs.incredibuild_schedule import (
+    DAY_NAMES,
+    MONTH_NAMES,
+    _cron_values,
+    _fire_times,
+    load_worker_schedule,
+)
+
+
+def write_schedule(tmp_path, windows, **schedule):
+    path = tmp_path.joinpath("worker_schedule.json")
+    path.write_text(json.dumps({"windows": windows, **schedule}))
+    return path
+
+
+def window(name, start, end=None, time_zone="UTC", **capacities):
+    return {
+        "name": name,
+        "start": start,
+        "end": end,
+        "time_zone": time_zone,
+        **(capacities or {"min_capacity": 1}),
+    }
+
+
+@pytest.mark.parametrize(
+    "field, low, high, names, first, values, unrestricted",
+    [
+        ("*", 0, 59, (), 0, set(range(60)), True),
+        ("*/15", 0, 59, (), 0, {0, 15, 30, 45}, True),
+        ("5/20", 0, 59, (), 0, {5, 25, 45}, False),
+        ("1,3-5", 0, 23, (), 0, {1, 3, 4, 5}, False),
+        ("*/2", 1, 31, (), 0, set(range(1, 32, 2)), True),
+        ("MON-FRI", 0, 7, DAY_NAMES, 0, {1, 2, 3, 4, 5}, False),
+        ("jan,Mar", 1, 12, MONTH_NAMES, 1, {1, 3}, False),
+        ("?", 0, 7, DAY_NAMES, 0, set(range(8)), True),
+    ],
+)
+def test_cron_values(field, low, high, names, first, values, unrestricted):
+    assert _cron_values(field, low, high, names, first) == (values, unrestricted)
+
+
+@pytest.mark.parametrize("field", ["60", "FRI-MON", "*/0", "", "1-", "MON"])
+def test_cron_values_rejects_invalid_fields(field):
+    with pytest.raises(ValueError):
+        _cron_values(field, 0, 59)
+
+
+def test_fire_times_follow_daylight_saving_time(tmp_path):
+    fire_times = _fire_times(
+        tmp_path,
+        window("WorkingHours", "30 8 * * MON", time_zone="America/Los_Angeles"),
+        "start",
+    )
+    assert datetime(2024, 1, 8, 16, 30) in fire_times
+    assert datetime(2024, 7, 1, 15, 30) in fire_times
+    assert len(fire_times) == 105
+
+
+def test_fire_times_match_either_restricted_day_field(tmp_path):
+    fire_times = _fire_times(tmp_path, window("Release", "0 0 13 * FRI"), "start")
+    # Every Friday, and every 13th, of 2024 and 2025
+    assert datetime(2024, 1, 5) in fire_times
+    assert datetime(2024, 1, 13) in fire_times
+    assert datetime(2024, 9, 13) in fire_times
+    assert len(fire_times) == len(set(fire_times)) == 104 + 24 - 3
+
+
+def test_fire_times_match_both_day_fields_when_one_is_a_star_step(tmp_path):
+    fire_times = _fire_times(tmp_path, window("Odd", "0 0 */2 * MON"), "start")
+    assert fire_times
+    assert all(
+        fire_time.day % 2 == 1 and fire_time.weekday() == 0 for fire_time in fire_times
+    )
+
+
+def test_load_worker_schedule(tmp_path):
+    path = write_schedule(
+        tmp_path,
+        [
+            {
+                "name": "WorkingHours",
+                "start": "30 8 * * MON-FRI",
+                "end": "0 19 * * MON-FRI",
+                "min_capacity": 8,
+            },
+            {
+                "name": "NightlyBuild",
+                "start": "45 1 * * *",
+                "end": "0 4 * * *",
+                "min_capacity": 20,
+                "desired_capacity": 20,
+            },
+        ],
+        time_zone="America/Los_Angeles",
+    )
+    windows = load_worker_schedule(path)
+    assert [window["name"] for window in windows] == ["WorkingHours", "NightlyBuild"]
+    assert [window["time_zone"] for window in windows] == ["America/Los_Angeles"] * 2
+    assert windows[1]["desired_capacity"] == 20
+
+
+@pytest.mark.parametrize(
+    "windows",
+    [
+        # A window starting while another one runs
+        [
+            {
+                "name": "Day",
+                "start": "0 8 * * *",
+                "end": "0 18 * * *",
+                "min_capacity": 4,
+            },
+            {"name": "Release", "start": "0 12 * * FRI", "min_capacity": 20},
+        ],
+        # A window starting as another one ends
+        [
+            {
+                "name": "Day",
+                "start": "0 8 * * *",
+                "end": "0 18 * * *",
+                "min_capacity": 4,
+            },
+            {"name": "Evening", "start": "0 18 * * *", "min_capacity": 2},
+        ],
+        # Windows that only overlap once daylight saving time starts
+        [
+            {
+                "name": "Local",
+                "start": "0 9 * * *",
+                "end": "0 10 * * *",
+                "time_zone": "Europe/London",
+                "min_capacity": 4,
+            },
+            {
+                "name": "Utc",
+                "start": "30 8 * * *",
+                "end": "45 8 * * *",
+                "min_capacity": 2,
+            },
+        ],
+    ],
+)
+def test_load_worker_schedule_rejects_overlapping_windows(tmp_path, windows):
+    with pytest.raises(SystemExit):
+        load_worker_schedule(write_schedule(tmp_path, windows))
+
+
+def test_load_worker_schedule_accepts_adjacent_time_zones(tmp_path):
+    windows = [
+        {
+            "name": "Local",
+            "start": "0 9 * * *",
+            "end": "0 10 * * *",
+            "time_zone": "Europe/London",
+            "min_capacity": 4,
+        },
+        {
+            "name": "Utc",
+            "start": "30 10 * * *",
+            "end": "45 10 * * *",
+            "min_capacity": 2,
+        },
+    ]
+    assert len(load_worker_schedule(write_schedule(tmp_path, windows))) == 2
+
+
+@pytest.mark.parametrize(
+    "capacities",
+    [
+        {"min_capacity": True},
+        {"desired_capacity": False},
+        {"min_capacity": -1},
+        {"max_capacity": 2.5},
+        {"min_capacity": 4, "max_capacity": 2},
+        {},
+    ],
+)
+def test_load_worker_schedule_rejects_invalid_capacities(tmp_path, capacities):
+    path = write_schedule(
+        tmp_path, [{"name": "Day", "start": "0 8 * * *", **capacities}]
+    )
+    with pytest.raises(SystemExit):
+        load_worker_schedule(path)
+
+
+@pytest.mark.parametrize(
+    "start",
+    ["0 8 * *", "0 24 * * *", "0 8 * * FRI-MON", "0 8 * FOO *"],
+)
+def test_load_worker_schedule_rejects_invalid_cron_expressions(tmp_path, start):
+    path = write_schedule(
+        tmp_path, [{"name": "Day", "start": start, "min_capacity": 1}]
+    )
+    with pytest.raises(SystemExit):
+        load_worker_schedule(path)
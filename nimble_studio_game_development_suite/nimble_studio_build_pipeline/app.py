@@ -6,7 +6,14 @@ from nimble_studio_build_pipeline_stacks.nimble_studio_build_pipeline_stack impo
     NimbleStudioBuildPipelineStack,
 )
 
-app = App()
+import sys
+
+sys.path.append("../../utils")
+from utils.discovery_snapshot import snapshot_context
+
+# When replaying a discovery snapshot, its recorded context lookups are fed back
+# into the App so that synthesis doesn't need to reach AWS
+app = App(context=snapshot_context())
 NimbleStudioBuildPipelineStack(
     app,
     "NimbleStudioBuildPipelineStack",
@@ -23,7 +23,7 @@ try {
 
     [Environment]::SetEnvironmentVariable("ARTIFACT_BUCKET", "ARTIFACT_BUCKET_ARN_PLACEHOLDER")
 
-    New-Item -Path "C:\\init-complete.txt" -ItemType File
+    New-Item -Path "C:\\init-complete.txt" -ItemType File -Force
   } catch [Exception] {
     echo $_.Exception.Message > exception.txt
   }
@@ -7,13 +7,15 @@ from aws_cdk import (
 )
 from constructs import Construct
 from typing import List
+from pathlib import Path
 import sys
 
 sys.path.append("../../utils")
-from utils.utils import (
-    create_ssm_policy,
-    replace_user_data_values,
-)
+from utils.ssm_configuration import SsmConfiguration
+from utils.user_data import UserDataTemplate
+from utils.utils import create_ssm_policy
+
+ASSETS_PATH = Path(__file__).parent.parent.joinpath("assets")
 
 
 class BuildNodeImageStack(NestedStack):
@@ -101,17 +103,6 @@ class BuildNodeImageStack(NestedStack):
             ),
         )
 
-        # Read UserData Script and replace placeholders
-        with open("assets/setup-build-node-instance.ps1", "r") as user_data_file:
-            user_data = user_data_file.read()
-
-        user_data_replacement_map = {
-            "ARTIFACT_BUCKET_ARN_PLACEHOLDER": artifact_bucket.bucket_arn
-        }
-        user_data = replace_user_data_values(
-            user_data=user_data, replacement_map=user_data_replacement_map
-        )
-
         self.instance: ec2.IInstance = ec2.Instance(
             self,
             "JenkinsBuildNode",
@@ -119,10 +110,23 @@ class BuildNodeImageStack(NestedStack):
             vpc_subnets=ec2.SubnetSelection(subnets=[subnet]),
             instance_type=instance_type,
             machine_image=machine_image,
-            user_data=ec2.UserData.custom(user_data),
+            user_data=ec2.UserData.for_windows(),
             role=self.build_instance_role,
             block_devices=[build_node_block_device],
             security_group=self.build_node_instance_sg,
             key_name=key_name,
         )
         Tags.of(self.instance).add("Name", "JenkinsBuildNode")
+
+        # The setup script is applied through SSM rather than user data, so changing it
+        # re-runs it on the build node instead of restarting or replacing it
+        self.configuration = SsmConfiguration(
+            self,
+            "JenkinsBuildNodeConfiguration",
+            script=UserDataTemplate.load(
+                ASSETS_PATH.joinpath("setup-build-node-instance.ps1")
+            ).render({"ARTIFACT_BUCKET_ARN_PLACEHOLDER": artifact_bucket.bucket_arn}),
+            instances=[self.instance],
+            platform=ec2.OperatingSystemType.WINDOWS,
+            description="Installs the Jenkins build node tools",
+        )
@@ -14,7 +14,7 @@ from nimble_studio_build_pipeline_stacks.setup_stack import SetupStack
 import sys
 
 sys.path.append("../../utils")
-from utils.config_retriever import ConfigRetriever
+from utils.config_retriever import ConfigRetriever, get_config_retriever
 
 
 class NimbleStudioBuildPipelineStack(Stack):
@@ -22,10 +22,20 @@ class NimbleStudioBuildPipelineStack(Stack):
 
         super().__init__(scope, construct_id, **kwargs)
 
-        config_retriever = ConfigRetriever()
+        config_retriever = get_config_retriever()
 
         self._validate_config(config_retriever=config_retriever)
 
+        config_retriever.prefetch(
+            "vpc_id",
+            "worker_support_subnet_id",
+            "worker_support_subnet_az",
+            "hosted_zone",
+            "vpce_sg_id",
+            "perforce_sg_id",
+            "workstations_sg_id",
+        )
+
         vpc: ec2.IVpc = ec2.Vpc.from_lookup(
             self, "StudioVPC", vpc_id=config_retriever.vpc_id
         )
@@ -1,13 +1,14 @@
 from aws_cdk import Duration, Tags, Stack, aws_ec2 as ec2, aws_iam as iam, aws_s3 as s3
 from constructs import Construct
 from typing import List
+from pathlib import Path
 import sys
 
 sys.path.append("../../utils")
-from utils.utils import (
-    create_ssm_policy,
-    replace_user_data_values,
-)
+from utils.user_data import add_user_data_from_template
+from utils.utils import create_ssm_policy
+
+ASSETS_PATH = Path(__file__).parent.parent.joinpath("assets")
 
 
 class JenkinsPattern(Construct):
@@ -102,18 +103,19 @@ class JenkinsPattern(Construct):
             self.instance.node.default_child
         )
 
-        # Read UserData Script and replace placeholders
-        with open("assets/setup-jenkins-instance.sh", "r") as user_data_file:
-            user_data = user_data_file.read()
-
+        # Render the UserData script, replacing its placeholders
         user_data_replacement_map = {
             "STACK_NAME_PLACEHOLDER": stack_name,
             "RESOURCE_LOGICAL_ID_PLACEHOLDER": jenkins_instance_logical_id,
             "REGION_PLACEHOLDER": region,
         }
-        user_data = replace_user_data_values(
-            user_data=user_data, replacement_map=user_data_replacement_map
+        add_user_data_from_template(
+            self,
+            "JenkinsUserData",
+            user_data=self.instance.user_data,
+            template_path=ASSETS_PATH.joinpath("setup-jenkins-instance.sh"),
+            replacement_map=user_data_replacement_map,
+            role=self.jenkins_role,
         )
-        self.instance.add_user_data(user_data)
 
         Tags.of(self.instance).add("Name", "Jenkins")
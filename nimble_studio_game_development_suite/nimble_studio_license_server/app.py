@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 from aws_cdk import App
 
+import sys
+
+sys.path.append("../../utils")
+from utils.discovery_snapshot import snapshot_context
+
+# When replaying a discovery snapshot, its recorded context lookups are fed back
+# into the App so that synthesis doesn't need to reach AWS. This comes first, as the
+# stack reads the recorded account and region when it's imported
+app = App(context=snapshot_context())
+
 from nimble_studio_license_server_stacks.nimble_studio_license_server_main_instance_stack import (
     NimbleStudioLicenseServerMainInstanceStack,
 )
 
-app = App()
 NimbleStudioLicenseServerMainInstanceStack(
     app,
     "NimbleStudioLicenseServerStack",
@@ -14,7 +14,7 @@ from nimble_studio_license_server_stacks.constants import Constants
 import sys
 
 sys.path.append("../../utils")
-from utils.config_retriever import ConfigRetriever
+from utils.config_retriever import get_config_retriever
 
 ACCOUNT = os.environ.get("CDK_DEFAULT_ACCOUNT", "111111111111")
 REGION = os.environ.get("CDK_DEFAULT_REGION", "us-west-2")
@@ -26,7 +26,15 @@ class NimbleStudioLicenseServerMainInstanceStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, env=AWS_ENV, **kwargs)
 
-        config_retriever = ConfigRetriever()
+        config_retriever = get_config_retriever()
+        config_retriever.prefetch(
+            "studio",
+            "vpc_id",
+            "license_server_security_group_id",
+            "worker_support_subnet_id",
+            "worker_support_subnet_az",
+        )
+
         studio_license_bucket = s3.Bucket(
             self,
             Constants.BUCKET_NAME,
@@ -4,7 +4,7 @@ from constructs import Construct
 import sys
 
 sys.path.append("../../utils")
-from utils.config_retriever import ConfigRetriever
+from utils.config_retriever import ConfigRetriever, get_config_retriever
 
 PERFORCE_SERVER_RECORD_PREFIX = "perforceserver."
 PERFORCE_SWARM_RECORD_PREFIX = "perforceswarm."
@@ -17,10 +17,25 @@ class NimbleStudioPerforceServerCommonStack(NestedStack):
 
     def __init__(self, scope: Construct, id: str, **kwargs):
         super().__init__(scope, id, **kwargs)
-        config_retriever = ConfigRetriever()
+        config_retriever = get_config_retriever()
 
         self._validate_config(config_retriever=config_retriever)
 
+        # Resolve everything the Perforce stacks need concurrently, only the first
+        # nested stack actually waits for this
+        config_retriever.prefetch(
+            "studio",
+            "vpc_id",
+            "vpc_cidr",
+            "worker_support_subnet_id",
+            "worker_support_subnet_az",
+            "worker_support_nacl_id",
+            "vpce_sg_id",
+            "workstations_sg_id",
+            "hosted_zone",
+            "helix_swarm_ami_map",
+        )
+
         # Lookup our pre-created VPC by ID
         self._vpc: ec2.IVpc = ec2.Vpc.from_lookup(
             self, "vpc", vpc_id=config_retriever.vpc_id
@@ -15,10 +15,13 @@ from nimble_studio_perforce_server_stacks.nimble_studio_perforce_server_common_s
     PERFORCE_SERVER_RECORD_PREFIX,
     PERFORCE_SWARM_RECORD_PREFIX,
 )
+from pathlib import Path
 import sys
 
 sys.path.append("../../utils")
-from utils.utils import replace_user_data_values
+from utils.user_data import add_user_data_from_template
+
+ASSETS_PATH = Path(__file__).parent.parent.joinpath("assets")
 
 
 class NimbleStudioPerforceServerMainInstanceStack(
@@ -103,10 +106,7 @@ class NimbleStudioPerforceServerMainInstanceStack(
         # ensure efs is ready
         self.perforce_server_instance_main.node.add_dependency(depot_filesystem)
 
-        # Read UserData Script and replace placeholders
-        with open("assets/setup-perforce-helix-core.sh", "r") as user_data_file:
-            user_data = user_data_file.read()
-
+        # Render the UserData script, replacing its placeholders
         user_data_replacement_map = {
             "SERVER_ID_PLACEHOLDER": "master.1",
             "PERFORCE_PASSWORD_ARN_PLACEHOLDER": secret.secret_full_arn,
@@ -118,12 +118,15 @@ class NimbleStudioPerforceServerMainInstanceStack(
             "LOCAL_P4_PORT_PLACEHOLDER": "ssl:localhost:1666",
             "FILESYSTEMID": depot_filesystem.file_system_id,
         }
-        user_data = replace_user_data_values(
-            user_data=user_data, replacement_map=user_data_replacement_map
+        add_user_data_from_template(
+            self,
+            "PerforceServerUserData",
+            user_data=self.perforce_server_instance_main.user_data,
+            template_path=ASSETS_PATH.joinpath("setup-perforce-helix-core.sh"),
+            replacement_map=user_data_replacement_map,
+            role=ec2_role,
         )
 
-        self.perforce_server_instance_main.add_user_data(user_data)
-
         Tags.of(self.perforce_server_instance_main).add(
             "Name",
             f"{self._stage}-helix-core",
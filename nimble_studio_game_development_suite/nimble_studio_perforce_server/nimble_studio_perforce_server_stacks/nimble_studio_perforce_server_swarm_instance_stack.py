@@ -13,10 +13,13 @@ from nimble_studio_perforce_server_stacks.nimble_studio_perforce_server_common_s
     PERFORCE_SERVER_RECORD_PREFIX,
     PERFORCE_SWARM_RECORD_PREFIX,
 )
+from pathlib import Path
 import sys
 
 sys.path.append("../../utils")
-from utils.utils import replace_user_data_values
+from utils.user_data import add_user_data_from_template
+
+ASSETS_PATH = Path(__file__).parent.parent.joinpath("assets")
 
 
 class NimbleStudioPerforceServerSwarmInstanceStack(
@@ -74,10 +77,7 @@ class NimbleStudioPerforceServerSwarmInstanceStack(
             self.perforce_swarm_instance_main.node.default_child
         )
 
-        # Read UserData Script and replace placeholders
-        with open("assets/setup-perforce-helix-swarm.sh", "r") as user_data_file:
-            user_data = user_data_file.read()
-
+        # Render the UserData script, replacing its placeholders
         user_data_replacement_map = {
             "SECRET_ARN_PLACEHOLDER": secret.secret_full_arn,
             "STACK_NAME_PLACEHOLDER": self.stack_name,
@@ -87,12 +87,15 @@ class NimbleStudioPerforceServerSwarmInstanceStack(
             "PERFORCE_SERVER_DNS_RECORD_PLACEHOLDER": perforce_server_dns_record,
             "PERFORCE_SWARM_DNS_RECORD_PLACEHOLDER": perforce_swarm_dns_record,
         }
-        user_data = replace_user_data_values(
-            user_data=user_data, replacement_map=user_data_replacement_map
+        add_user_data_from_template(
+            self,
+            "PerforceSwarmUserData",
+            user_data=self.perforce_swarm_instance_main.user_data,
+            template_path=ASSETS_PATH.joinpath("setup-perforce-helix-swarm.sh"),
+            replacement_map=user_data_replacement_map,
+            role=ec2_role,
         )
 
-        self.perforce_swarm_instance_main.add_user_data(user_data)
-
         Tags.of(self.perforce_swarm_instance_main).add(
             "Name", f"{self._stage}-helix-swarm"
         )
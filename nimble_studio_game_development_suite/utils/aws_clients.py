@@ -0,0 +1,56 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+# Adaptive retries add client-side rate limiting on top of exponential backoff, which
+# keeps us from getting throttled when several apps are synthesized in parallel
+RETRY_CONFIG = Config(
+    retries={
+        "max_attempts": int(os.environ.get("AWS_MAX_ATTEMPTS", "10")),
+        "mode": "adaptive",
+    },
+    max_pool_connections=32,
+)
+
+_session: Optional[boto3.session.Session] = None
+_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+_lock = threading.Lock()
+
+
+def get_session() -> boto3.session.Session:
+    """Returns the boto3 session shared by all discovery code in the suite"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        return _session
+
+
+def get_client(service_name: str, region_name: str = None):
+    """
+    Returns a pooled client for service_name, creating it on first use.
+
+    Sessions aren't thread safe, so clients are created under a lock; the clients
+    themselves are thread safe and are shared by every caller.
+    """
+    session = get_session()
+    key = (service_name, region_name)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = session.client(
+                service_name, region_name=region_name, config=RETRY_CONFIG
+            )
+            _clients[key] = client
+        return client
+
+
+def reset(session: boto3.session.Session = None) -> None:
+    """Drops every pooled client, optionally replacing the shared session"""
+    global _session
+    with _lock:
+        _session = session
+        _clients.clear()
@@ -1,8 +1,154 @@
-import boto3
 import os
-import random
 import sys
-from typing import Any, Dict
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from botocore import exceptions
+
+from utils.aws_clients import get_client, get_session
+from utils.discovery_cache import DAY, HOUR, WEEK, DiscoveryCache
+from utils.discovery_snapshot import DiscoverySnapshot
+
+
+class _DiscoveredAttribute:
+    """Resolves a ConfigRetriever attribute on first access and caches the result"""
+
+    def __init__(
+        self, resolver: Callable[["ConfigRetriever"], Any], ttl: Optional[int]
+    ):
+        self._resolver = resolver
+        self.name = resolver.__name__
+        self.ttl = ttl
+        self.__doc__ = resolver.__doc__
+
+    def __get__(self, instance: "ConfigRetriever", owner: type = None):
+        if instance is None:
+            return self
+        return instance._resolve(self.name, lambda: self._resolver(instance), self.ttl)
+
+
+def _discovered(ttl: Optional[int] = None):
+    """
+    Marks a ConfigRetriever method as a lazily discovered attribute.
+
+    Attributes with a ttl are also persisted in the on-disk DiscoveryCache for that
+    many seconds.
+    """
+
+    def decorator(resolver: Callable[["ConfigRetriever"], Any]):
+        return _DiscoveredAttribute(resolver, ttl)
+
+    return decorator
+
+
+class SubnetIndex:
+    """An in-memory index of a VPC's subnets by Name tag and availability zone id"""
+
+    WORKSTATIONS_SUBNET_NAME = "Workstations"
+
+    def __init__(self, subnets: List[Dict[str, Any]]):
+        self._by_name: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_name_and_az: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+
+        for subnet in subnets:
+            name = self.subnet_name(subnet)
+            if name is None:
+                continue
+            self._by_name.setdefault(name, []).append(subnet)
+            self._by_name_and_az.setdefault(
+                (name, subnet["AvailabilityZoneId"]), []
+            ).append(subnet)
+
+        self.workstation_az_ids = {
+            subnet["AvailabilityZoneId"]
+            for subnet in self.find_all(self.WORKSTATIONS_SUBNET_NAME)
+        }
+
+        # The first subnet (in API order) of each name that shares an AZ with a
+        # Workstations subnet, which is what most lookups are after
+        self._in_workstation_az: Dict[str, Dict[str, Any]] = {}
+        for name, named_subnets in self._by_name.items():
+            for subnet in named_subnets:
+                if subnet["AvailabilityZoneId"] in self.workstation_az_ids:
+                    self._in_workstation_az[name] = subnet
+                    break
+
+    @staticmethod
+    def is_local_zone(subnet: Dict[str, Any]) -> bool:
+        # Availability zone ids look like 'usw2-az1', while local and Wavelength zone
+        # ids also name their location, e.g. 'usw2-lax1-az1'
+        return subnet["AvailabilityZoneId"].count("-") > 1
+
+    @staticmethod
+    def subnet_name(subnet: Dict[str, Any]) -> Optional[str]:
+        for tag in subnet.get("Tags", []):
+            if tag.get("Key", "") == "Name":
+                return tag["Value"]
+        return None
+
+    def find_all(self, name: str) -> List[Dict[str, Any]]:
+        return self._by_name.get(name, [])
+
+    def find_in_az(self, name: str, az_id: str) -> List[Dict[str, Any]]:
+        return self._by_name_and_az.get((name, az_id), [])
+
+    def find_in_workstation_az(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._in_workstation_az.get(name)
+
+    def find_near_workstations(self, name: str) -> List[Dict[str, Any]]:
+        """
+        Returns the subnets of that name in every AZ of the region, and in the local
+        zones that have a Workstations subnet, with the Workstations zones first.
+        """
+        subnets = [
+            subnet
+            for subnet in self.find_all(name)
+            if not self.is_local_zone(subnet)
+            or subnet["AvailabilityZoneId"] in self.workstation_az_ids
+        ]
+        return sorted(
+            subnets,
+            key=lambda subnet: subnet["AvailabilityZoneId"]
+            not in self.workstation_az_ids,
+        )
+
+
+class StackOutputIndex:
+    """
+    An index of a CloudFormation stack's outputs by key prefix and value prefix.
+
+    Output keys are kept sorted so that a prefix lookup is a binary search, and every
+    (key prefix, value prefix) lookup is memoized so repeated lookups are dict hits.
+    """
+
+    def __init__(self, stack_name: str, outputs: Dict[str, str]):
+        self.stack_name = stack_name
+        self._outputs = outputs
+        self._keys = sorted(outputs)
+        self._lookups: Dict[Tuple[str, str], Optional[str]] = {}
+
+    def find(self, key_prefix: str, value_prefix: str = "") -> str:
+        lookup = (key_prefix, value_prefix)
+        if lookup not in self._lookups:
+            self._lookups[lookup] = self._find(key_prefix, value_prefix)
+
+        value = self._lookups[lookup]
+        if value is None:
+            raise ValueError(
+                f"Couldn't find export name '{key_prefix}' in stack '{self.stack_name}'"
+            )
+        return value
+
+    def _find(self, key_prefix: str, value_prefix: str) -> Optional[str]:
+        index = bisect_left(self._keys, key_prefix)
+        while index < len(self._keys) and self._keys[index].startswith(key_prefix):
+            value = self._outputs[self._keys[index]]
+            if value.startswith(value_prefix):
+                return value
+            index += 1
+        return None
 
 
 class ConfigRetriever:
@@ -11,39 +157,260 @@ class ConfigRetriever:
     PERFORCE_KEY_PAIR_NAME_ENV_VAR = "CDK_PERFORCE_KEY_PAIR_NAME"
     JENKINS_KEY_PAIR_NAME_ENV_VAR = "CDK_BUILD_PIPELINE_KEY_PAIR_NAME"
     JENKINS_BUILD_NODE_AMI_ID_ENV_VAR = "CDK_JENKINS_BUILD_NODE_AMI_ID"
+    HELIX_SWARM_AMI_OWNERS_ENV_VAR = "CDK_HELIX_SWARM_AMI_OWNERS"
+    HELIX_SWARM_AMI_REGIONS_ENV_VAR = "CDK_HELIX_SWARM_AMI_REGIONS"
+    STUDIO_HOSTED_ZONE_ENV_VAR = "CDK_STUDIO_HOSTED_ZONE"
+
+    HELIX_SWARM_AMI_NAME_PATTERN = "Perforce-Swarm-SDP-AMI-Base*"
+    HELIX_SWARM_AMI_DEFAULT_OWNERS = "aws-marketplace"
 
-    def __init__(self):
-        self.existing_subnets = {"WorkerSupport": [], "Workstations": []}
-        self.workstation_subnet_azs = []
-
-        self.studio = self.get_studio()
-        self.studio_id = self.studio['studioId']
-        self.studio_name = self.studio["studioName"]
-        self.region = self.studio["homeRegion"]
-        self.vpc_id = self.get_vpc_id(self.studio_name)
-        self.vpc_cidr = self.get_vpc_cidr(self.vpc_id)
-        self.vpce_sg_id = self.get_vpc_interface_endpoint_sg_id(self.studio_name)
-        self.render_worker_subnet = self.find_subnet_by_name("RenderWorkers", self.vpc_id)
-        self.workstations_sg_id = self.get_workstations_sg_id(self.studio_name)
-        self.worker_support_subnet = self.find_worker_support_subnet(self.vpc_id)
-        self.worker_support_subnet_id = self.find_worker_support_subnet_id(self.vpc_id)
-        self.worker_support_subnet_az = self.find_worker_support_subnet_az(self.vpc_id)
-        self.worker_support_nacl_id = self.find_subnet_network_acl_id(vpc_id=self.vpc_id, subnet_id=self.worker_support_subnet_id)
-        self.hosted_zone = self.find_studio_hosted_zone(self.vpc_id)
-        self.helix_swarm_ami_map = self.retrieve_helix_swarm_ami_map(self.region)
-        self.perforce_sg_id = self.get_perforce_sg_id()
-        self.license_server_security_group_id = (
-            self.get_license_server_security_group_id()
+    def __init__(
+        self,
+        discovery_cache: DiscoveryCache = None,
+        discovery_snapshot: DiscoverySnapshot = None,
+    ):
+        self._resolved: Dict[str, Any] = {}
+        self._resolve_locks: Dict[str, threading.RLock] = {}
+        self._lock = threading.Lock()
+        self._discovery_cache = discovery_cache or DiscoveryCache.from_environment()
+        self._discovery_snapshot = (
+            discovery_snapshot or DiscoverySnapshot.from_environment()
         )
-        # parameters get from user
+
+        # parameters get from user. These never touch the network, so stacks can
+        # validate them before any discovery happens.
         self.perforce_notification_email = self.get_perforce_notification_email()
         self.perforce_key_pair_name = self.get_perforce_key_pair_name()
         self.stage = os.environ.get("CDK_STAGE", "DEV")
         self.jenkins_key_pair_name = self.get_jenkins_key_pair_name()
         self.build_node_ami_id = self.get_build_node_ami_id()
 
+    def _resolve(self, name: str, resolver: Callable[[], Any], ttl: Optional[int]):
+        if name in self._resolved:
+            return self._resolved[name]
+
+        # Each attribute has its own lock, so concurrent readers of the same attribute
+        # wait for a single lookup while unrelated attributes resolve in parallel
+        with self._lock:
+            resolve_lock = self._resolve_locks.setdefault(name, threading.RLock())
+
+        with resolve_lock:
+            if name not in self._resolved:
+                if ttl:
+                    self._resolved[name] = self._resolve_recorded(name, resolver, ttl)
+                else:
+                    self._resolved[name] = resolver()
+            return self._resolved[name]
+
+    def _resolve_recorded(self, name: str, resolver: Callable[[], Any], ttl: int):
+        # Attributes with a ttl are the ones holding raw AWS results; everything
+        # else is derived from them, so only these need recording and replaying
+        snapshot = self._discovery_snapshot
+        if snapshot and snapshot.replaying:
+            return snapshot.replay(name)
+
+        value = self._resolve_cached(name, resolver, ttl)
+        if snapshot and snapshot.recording:
+            snapshot.record(name, value)
+        return value
+
+    def _resolve_cached(self, name: str, resolver: Callable[[], Any], ttl: int):
+        # The studio itself is what tells us the studio id, so it can only be scoped
+        # by account and region
+        scope = {"account": self.account_id, "region": self.session_region}
+        if name != "studio":
+            scope["studio"] = self.studio_id
+        key = DiscoveryCache.make_key(name, **scope)
+
+        found, value = self._discovery_cache.get(key)
+        if found:
+            return value
+
+        value = resolver()
+        # Missing resources (e.g. the Perforce SG before Perforce is deployed) are
+        # not cached, so they are picked up as soon as they exist
+        if value is not None:
+            self._discovery_cache.put(key, value, ttl)
+        return value
+
+    @classmethod
+    def discovered_attribute_names(cls, persisted_only: bool = False):
+        return [
+            attribute.name
+            for attribute in vars(cls).values()
+            if isinstance(attribute, _DiscoveredAttribute)
+            and (attribute.ttl or not persisted_only)
+        ]
+
+    def prefetch(self, *names: str, max_workers: int = 8) -> None:
+        """
+        Resolves the given discovered attributes (all of them by default) concurrently.
+
+        Lookups that depend on another attribute, such as everything needing the VPC
+        id, block only until that attribute is resolved, so discovery takes as long as
+        the longest chain of AWS calls rather than the sum of them all.
+        """
+        names = names or tuple(self.discovered_attribute_names())
+        pending = [name for name in names if name not in self._resolved]
+        if not pending:
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(pending)),
+            thread_name_prefix="ConfigRetriever",
+        ) as executor:
+            futures = [executor.submit(getattr, self, name) for name in pending]
+
+        # Re-raise the first failure (including sys.exit) on the calling thread
+        for future in futures:
+            future.result()
+
+    def refresh_discovery_cache(self):
+        """Re-runs discovery for every attribute, reporting the ones that fail"""
+        names = self.discovered_attribute_names()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {name: executor.submit(getattr, self, name) for name in names}
+
+        for name, future in futures.items():
+            try:
+                future.result()
+            except (Exception, SystemExit) as e:
+                print(f"WARNING: Unable to discover '{name}': {e}")
+
+    # Discovered attributes. Each one is only looked up the first time it is read,
+    # so an app only pays for the AWS calls behind the attributes it actually uses.
+
+    @_discovered()
+    def account_id(self):
+        return (
+            os.environ.get("CDK_DEFAULT_ACCOUNT")
+            or get_client("sts").get_caller_identity()["Account"]
+        )
+
+    @_discovered()
+    def session_region(self):
+        return get_session().region_name
+
+    @_discovered(ttl=DAY)
+    def studio(self):
+        return self.get_studio()
+
+    @property
+    def studio_id(self):
+        return self.studio["studioId"]
+
+    @property
+    def studio_name(self):
+        return self.studio["studioName"]
+
+    @property
+    def region(self):
+        return self.studio["homeRegion"]
+
+    @_discovered(ttl=WEEK)
+    def network_stack_outputs(self):
+        return self.get_stack_outputs(self.studio_name, "Network")
+
+    @_discovered(ttl=WEEK)
+    def data_stack_outputs(self):
+        return self.get_stack_outputs(self.studio_name, "Data")
+
+    @_discovered()
+    def vpc_id(self):
+        return self.get_vpc_id(self.studio_name)
+
+    @_discovered(ttl=WEEK)
+    def vpc_cidr(self):
+        return self.get_vpc_cidr(self.vpc_id)
+
+    @_discovered()
+    def vpce_sg_id(self):
+        return self.get_vpc_interface_endpoint_sg_id(self.studio_name)
+
+    @_discovered(ttl=DAY)
+    def subnets(self):
+        return self.describe_vpc_subnets(self.vpc_id)
+
+    @_discovered()
+    def subnet_index(self):
+        return SubnetIndex(self.subnets)
+
+    @property
+    def workstation_subnet_azs(self):
+        return self.subnet_index.workstation_az_ids
+
+    @_discovered()
+    def render_worker_subnet(self):
+        return self.find_subnet_by_name("RenderWorkers", self.vpc_id)
+
+    @_discovered()
+    def render_worker_subnets(self):
+        return self.find_render_worker_subnets(self.vpc_id)
+
+    @_discovered()
+    def workstations_sg_id(self):
+        return self.get_workstations_sg_id(self.studio_name)
+
+    @_discovered()
+    def worker_support_subnet(self):
+        return self.find_worker_support_subnet(self.vpc_id)
+
+    @_discovered()
+    def worker_support_subnet_id(self):
+        return self.find_worker_support_subnet_id(self.vpc_id)
+
+    @_discovered()
+    def worker_support_subnet_az(self):
+        return self.find_worker_support_subnet_az(self.vpc_id)
+
+    @_discovered(ttl=DAY)
+    def worker_support_nacl_id(self):
+        return self.find_subnet_network_acl_id(
+            vpc_id=self.vpc_id, subnet_id=self.worker_support_subnet_id
+        )
+
+    @_discovered(ttl=DAY)
+    def s3_gateway_endpoints(self):
+        return self.find_s3_gateway_endpoints(self.vpc_id)
+
+    @_discovered(ttl=DAY)
+    def route_tables(self):
+        return self.find_route_tables(self.vpc_id)
+
+    @_discovered(ttl=DAY)
+    def studio_hosted_zones(self):
+        return self.find_studio_hosted_zones(self.vpc_id)
+
+    # Selected from the cached candidates on every synth, so that changing
+    # CDK_STUDIO_HOSTED_ZONE takes effect without clearing the discovery cache
+    @_discovered()
+    def hosted_zone(self):
+        return self.select_studio_hosted_zone(
+            self.studio_hosted_zones,
+            os.environ.get(ConfigRetriever.STUDIO_HOSTED_ZONE_ENV_VAR),
+        )
+
+    @_discovered()
+    def helix_swarm_ami_map(self):
+        additional_regions = [
+            region.strip()
+            for region in os.environ.get(
+                ConfigRetriever.HELIX_SWARM_AMI_REGIONS_ENV_VAR, ""
+            ).split(",")
+            if region.strip() and region.strip() != self.region
+        ]
+        return self.retrieve_helix_swarm_ami_map(self.region, *additional_regions)
+
+    @_discovered(ttl=HOUR)
+    def perforce_sg_id(self):
+        return self.get_perforce_sg_id()
+
+    @_discovered(ttl=DAY)
+    def license_server_security_group_id(self):
+        return self.get_license_server_security_group_id()
+
     def get_studio(self):
-        client = boto3.client("nimble")
+        client = get_client("nimble")
         response = client.list_studios()
         studios = response["studios"]
         if not studios:
@@ -53,33 +420,55 @@ class ConfigRetriever:
 
     def find_cloudformation_stack(self, studio_name: str, stack_type: str):
         stack_name = f"{studio_name}{stack_type}"
-        client = boto3.client("cloudformation")
+        client = get_client("cloudformation")
         response = client.describe_stacks(StackName=stack_name)
         return response["Stacks"][0]
 
+    def get_stack_outputs(self, studio_name: str, stack_type: str):
+        stack_data = self.find_cloudformation_stack(studio_name, stack_type)
+        return {
+            "StackName": stack_data["StackName"],
+            "Outputs": {
+                output["OutputKey"]: output["OutputValue"]
+                for output in stack_data.get("Outputs", [])
+            },
+        }
+
+    def stack_output_index(self, stack_type: str) -> "StackOutputIndex":
+        """Returns the output index of the studio's <studio>Network or <studio>Data stack"""
+        if stack_type == "Network":
+            stack_outputs = self.network_stack_outputs
+        elif stack_type == "Data":
+            stack_outputs = self.data_stack_outputs
+        else:
+            raise ValueError(f"Unknown studio stack type '{stack_type}'")
+
+        return self._resolve(
+            f"{stack_type.lower()}_stack_output_index",
+            lambda: StackOutputIndex(
+                stack_outputs["StackName"], stack_outputs["Outputs"]
+            ),
+            None,
+        )
+
     def find_output_value(
-        self, stack_data: Dict[str, Any], export_name: str, value_prefix: str = ""
+        self,
+        output_index: "StackOutputIndex",
+        export_name: str,
+        value_prefix: str = "",
     ):
-        outputs = stack_data["Outputs"]
-        for output in outputs:
-            if output["OutputKey"].startswith(export_name):
-                if value_prefix:
-                    if not output["OutputValue"].startswith(value_prefix):
-                        continue
-                return output["OutputValue"]
-        raise ValueError(
-            f"Couldn't find export name '{export_name}' in stack '{stack_data['StackName']}'"
-        )
+        return output_index.find(export_name, value_prefix)
 
     def get_vpc_id(self, studio_name: str):
-        network_stack = self.find_cloudformation_stack(studio_name, "Network")
         vpc_id = self.find_output_value(
-            network_stack, "ExportsOutputRefStudioDefaultVpc", "vpc-"
+            self.stack_output_index("Network"),
+            "ExportsOutputRefStudioDefaultVpc",
+            "vpc-",
         )
         return vpc_id
 
     def get_vpc_cidr(self, vpc_id: str):
-        client = boto3.client("ec2")
+        client = get_client("ec2")
         response = client.describe_vpcs(
             VpcIds=[vpc_id],
         )
@@ -90,10 +479,9 @@ class ConfigRetriever:
         return vpcs[0]["CidrBlock"]
 
     def get_vpc_interface_endpoint_sg_id(self, studio_name: str):
-        network_stack = self.find_cloudformation_stack(studio_name, "Network")
         try:
             sg_id = self.find_output_value(
-                network_stack,
+                self.stack_output_index("Network"),
                 "ExportsOutputFnGetAttStudioDefaultVpcInterfaceEndpointSG",
                 "sg-",
             )
@@ -103,16 +491,15 @@ class ConfigRetriever:
         return sg_id
 
     def get_workstations_sg_id(self, studio_name: str):
-        data_stack = self.find_cloudformation_stack(studio_name, "Data")
         sg_id = self.find_output_value(
-            data_stack,
+            self.stack_output_index("Data"),
             "ExportsOutputFnGetAttWorkstationEgress",
             "sg-",
         )
         return sg_id
 
     def get_perforce_sg_id(self) -> str or None:
-        client = boto3.client("ec2")
+        client = get_client("ec2")
         response = client.describe_security_groups(
             Filters=[
                 {
@@ -127,87 +514,47 @@ class ConfigRetriever:
             return response["SecurityGroups"][0]["GroupId"]
         return None
 
-    def get_subnets(self, vpc_id: str, subnet_name: str):
-
-        # If we've already fetched the subnet, let's not query for it again
-        subnets = self.existing_subnets.get(subnet_name)
-        if subnets:
-            return subnets
-
-        subnet_values = (
-            [subnet_name]
-            if self.existing_subnets["WorkerSupport"]
-            else ["WorkerSupport", "Workstations", subnet_name]
-        )
-
-        client = boto3.client("ec2")
-        response = client.describe_subnets(
-            Filters=[
-                {
-                    "Name": "vpc-id",
-                    "Values": [
-                        vpc_id,
-                    ],
-                },
-                {
-                    "Name": "tag:Name",
-                    "Values": subnet_values,
-                },
-            ],
-        )
-
-        other_subnets = []
-        worker_support_subnets = []
-        workstation_subnets = []
-        self.workstation_subnet_azs = {}
-
-        for subnet in response["Subnets"]:
-            for tag in subnet["Tags"]:
-                if tag.get("Key", "") == "Name":
-                    if tag["Value"] == "Workstations":
-                        workstation_subnets.append(subnet)
-                        self.workstation_subnet_azs[subnet["AvailabilityZoneId"]] = subnet
-                    elif tag["Value"] == "WorkerSupport":
-                        worker_support_subnets.append(subnet)
-                    else:
-                        other_subnets.append(subnet)
-
-        if worker_support_subnets:
-            self.existing_subnets["WorkerSupport"] = worker_support_subnets
-        if workstation_subnets:
-            self.existing_subnets["Workstations"] = workstation_subnets
-        if other_subnets:
-            self.existing_subnets[subnet_name] = other_subnets
-
-        return self.existing_subnets[subnet_name]
+    def describe_vpc_subnets(self, vpc_id: str) -> List[Dict[str, Any]]:
+        """Returns every subnet in the VPC (including local zone subnets) in one paginated call"""
+        paginator = get_client("ec2").get_paginator("describe_subnets")
+        subnets = []
+        for page in paginator.paginate(
+            Filters=[{"Name": "vpc-id", "Values": [vpc_id]}]
+        ):
+            subnets.extend(page["Subnets"])
+        return subnets
+
+    def get_subnet_index(self, vpc_id: str) -> SubnetIndex:
+        # The studio VPC's index is discovered (and cached) once, other VPCs are
+        # described on demand
+        if vpc_id == self.vpc_id:
+            return self.subnet_index
+        return SubnetIndex(self.describe_vpc_subnets(vpc_id))
 
+    def get_subnets(self, vpc_id: str, subnet_name: str):
+        return self.get_subnet_index(vpc_id).find_all(subnet_name)
 
     def find_subnet_by_name(
         self, subnet_name: str, vpc_id: str, matching_workstations_az: bool = True
     ):
-        subnets = self.get_subnets(vpc_id, subnet_name)
-
         if matching_workstations_az:
             # Local zones will introduce multiple "Workstations" subnets, so we need
-            # to find the WorkerSupport subnet in the same AZ
-            for subnet in subnets:
-                if subnet["AvailabilityZoneId"] in self.workstation_subnet_azs:
-                    return subnet
+            # to find the subnet in the same AZ as one of them
+            return self.get_subnet_index(vpc_id).find_in_workstation_az(subnet_name)
 
         return None
 
+    def find_render_worker_subnets(self, vpc_id: str) -> List[Dict[str, Any]]:
+        subnets = self.get_subnet_index(vpc_id).find_near_workstations("RenderWorkers")
 
-    def find_worker_support_subnet(self, vpc_id: str):
-        worker_support_subnets = self.get_subnets(vpc_id, "WorkerSupport")
-
-        # Local zones will introduce multiple "Workstations" subnets, so we need
-        # to find the WorkerSupport subnet in the same AZ
-        for subnet in worker_support_subnets:
-            if subnet["AvailabilityZoneId"] in self.workstation_subnet_azs:
-                return subnet
+        if not subnets:
+            print(f"ERROR: Couldn't find RenderWorkers subnets in studio VPC {vpc_id}.")
+            sys.exit(1)
 
-        return None
+        return subnets
 
+    def find_worker_support_subnet(self, vpc_id: str):
+        return self.find_subnet_by_name("WorkerSupport", vpc_id)
 
     def find_worker_support_subnet_id(self, vpc_id: str):
         subnet = self.find_worker_support_subnet(vpc_id)
@@ -227,43 +574,8 @@ class ConfigRetriever:
 
         return subnet["AvailabilityZone"]
 
-    def get_worker_support_subnet(self, vpc_id: str):
-        client = boto3.client("ec2")
-        response = client.describe_subnets(
-            Filters=[
-                {
-                    "Name": "vpc-id",
-                    "Values": [
-                        vpc_id,
-                    ],
-                },
-                {
-                    "Name": "tag:Name",
-                    "Values": [
-                        "WorkerSupport",
-                        "Workstations",
-                    ],
-                },
-            ],
-        )
-        worker_support_subnets = []
-        workstation_subnet_azs = {}
-        for subnet in response["Subnets"]:
-            for tag in subnet["Tags"]:
-                if tag.get("Key", "") == "Name":
-                    if tag["Value"] == "Workstations":
-                        workstation_subnet_azs[subnet["AvailabilityZoneId"]] = subnet
-                    else:
-                        worker_support_subnets.append(subnet)
-        # Local zones will introduce multiple "Workstations" subnets, so we need
-        # to find the WorkerSupport subnet in the same AZ
-        for subnet in worker_support_subnets:
-            if subnet["AvailabilityZoneId"] in workstation_subnet_azs:
-                return subnet
-        return None
-
     def find_subnet_network_acl_id(self, vpc_id: str, subnet_id: str):
-        client = boto3.client("ec2")
+        client = get_client("ec2")
         response = client.describe_network_acls(
             Filters=[
                 {"Name": "vpc-id", "Values": [vpc_id]},
@@ -277,64 +589,302 @@ class ConfigRetriever:
 
         return response["NetworkAcls"][0]["Associations"][0]["NetworkAclId"]
 
-    def find_studio_hosted_zone(self, vpc_id: str):
-        account_id = boto3.client("sts").get_caller_identity().get("Account")
-
-        session = boto3.session.Session()
-        region = session.region_name
-
-        client = session.client("route53")
+    def find_s3_gateway_endpoints(self, vpc_id: str) -> List[Dict[str, Any]]:
+        """Returns the id and route tables of every S3 gateway endpoint in the VPC"""
+        paginator = get_client("ec2").get_paginator("describe_vpc_endpoints")
+        endpoints = []
+        for page in paginator.paginate(
+            Filters=[
+                {"Name": "vpc-id", "Values": [vpc_id]},
+                {"Name": "vpc-endpoint-type", "Values": ["Gateway"]},
+                {
+                    "Name": "service-name",
+                    "Values": [f"com.amazonaws.{self.session_region}.s3"],
+                },
+            ]
+        ):
+            endpoints.extend(
+                {
+                    "id": endpoint["VpcEndpointId"],
+                    "route_table_ids": endpoint.get("RouteTableIds", []),
+                }
+                for endpoint in page["VpcEndpoints"]
+            )
+        return endpoints
+
+    def find_route_tables(self, vpc_id: str) -> Dict[str, Any]:
+        """
+        Returns the id of the VPC's main route table, and the id of the route table
+        explicitly associated with each subnet, by subnet id. Subnets without an
+        explicit association use the main route table.
+        """
+        paginator = get_client("ec2").get_paginator("describe_route_tables")
+        route_tables = {"main": None, "subnets": {}}
+        for page in paginator.paginate(
+            Filters=[{"Name": "vpc-id", "Values": [vpc_id]}]
+        ):
+            for route_table in page["RouteTables"]:
+                for association in route_table.get("Associations", []):
+                    if association.get("Main"):
+                        route_tables["main"] = route_table["RouteTableId"]
+                    elif "SubnetId" in association:
+                        route_tables["subnets"][association["SubnetId"]] = route_table[
+                            "RouteTableId"
+                        ]
+        return route_tables
+
+    @staticmethod
+    def get_subnet_route_table_ids(
+        route_tables: Dict[str, Any], subnet_ids: List[str]
+    ) -> List[str]:
+        """Returns the ids of the route tables used by the given subnets, sorted"""
+        return sorted(
+            {
+                route_tables["subnets"].get(subnet_id, route_tables["main"])
+                for subnet_id in subnet_ids
+            }
+        )
 
-        hosted_zones = client.list_hosted_zones_by_vpc(VPCId=vpc_id, VPCRegion=region)
+    def find_studio_hosted_zones(self, vpc_id: str) -> List[Dict[str, str]]:
+        """Returns the hosted zones owned by the account associated with vpc_id, sorted by name and id"""
+        client = get_client("route53")
+        request = {"VPCId": vpc_id, "VPCRegion": self.session_region}
 
         valid_hosted_zones = []
-        for hosted_zone in hosted_zones["HostedZoneSummaries"]:
-            owner = hosted_zone["Owner"]
-
-            # Make sure we only return the hosted zones owned by the account (otherwise)
-            # the results include things like EFS
-            try:
-                if owner["OwningAccount"] == account_id:
+        while True:
+            response = client.list_hosted_zones_by_vpc(**request)
+            for hosted_zone in response["HostedZoneSummaries"]:
+                # Make sure we only return the hosted zones owned by the account (otherwise)
+                # the results include things like EFS
+                owner = hosted_zone["Owner"]
+                if owner.get("OwningAccount") == self.account_id:
                     valid_hosted_zones.append(
                         {"id": hosted_zone["HostedZoneId"], "name": hosted_zone["Name"]}
                     )
-            except KeyError:
-                pass
+
+            next_token = response.get("NextToken")
+            if not next_token:
+                break
+            request["NextToken"] = next_token
+
         if len(valid_hosted_zones) == 0:
             print("ERROR: No hosted zone associated by VPC were found in your account.")
-            sys.exit(1)   
+            sys.exit(1)
+
+        return sorted(valid_hosted_zones, key=lambda zone: (zone["name"], zone["id"]))
+
+    @staticmethod
+    def select_studio_hosted_zone(
+        hosted_zones: List[Dict[str, str]], requested_zone: Optional[str] = None
+    ) -> Dict[str, str]:
+        """
+        Picks the hosted zone to create the suite's DNS records in.
+
+        requested_zone may be a zone name or id; otherwise the first zone by name is
+        used, so that the same studio always synthesizes the same records.
+        """
+        if requested_zone:
+            requested_zone = requested_zone.strip()
+            for hosted_zone in hosted_zones:
+                if (
+                    hosted_zone["name"].rstrip(".") == requested_zone.rstrip(".")
+                    or hosted_zone["id"].split("/")[-1] == requested_zone.split("/")[-1]
+                ):
+                    return hosted_zone
+
+            print(
+                f"ERROR: Hosted zone '{requested_zone}' set in "
+                f"{ConfigRetriever.STUDIO_HOSTED_ZONE_ENV_VAR} is not associated with "
+                f"the studio VPC. Found: {', '.join(zone['name'] for zone in hosted_zones)}"
+            )
+            sys.exit(1)
 
-        return random.choice(valid_hosted_zones)
+        if len(hosted_zones) > 1:
+            print(
+                f"WARNING: Found {len(hosted_zones)} hosted zones associated with the studio "
+                f"VPC, using '{hosted_zones[0]['name']}'. Set "
+                f"{ConfigRetriever.STUDIO_HOSTED_ZONE_ENV_VAR} to choose another one."
+            )
+        return hosted_zones[0]
+
+    def retrieve_helix_swarm_ami_map(self, *regions: str):
+        """Resolves the latest Helix Swarm AMI of each region concurrently"""
+        if len(regions) == 1:
+            return {regions[0]: self.get_helix_swarm_ami_id(regions[0])}
+
+        with ThreadPoolExecutor(
+            max_workers=len(regions), thread_name_prefix="HelixSwarmAmi"
+        ) as executor:
+            futures = {
+                region: executor.submit(self.get_helix_swarm_ami_id, region)
+                for region in regions
+            }
+        return {region: future.result() for region, future in futures.items()}
+
+    def get_helix_swarm_ami_id(self, region: str):
+        return self._resolve(
+            f"helix_swarm_ami_id:{region}",
+            lambda: self.find_latest_helix_swarm_ami_id(region),
+            DAY,
+        )
 
-    def retrieve_helix_swarm_ami_map(self, region: str):
-        client = boto3.client("ec2")
+    def find_latest_helix_swarm_ami_id(self, region: str):
+        client = get_client("ec2", region_name=region)
 
         # AMI name coming from:
         # https://s3.us-east-1.amazonaws.com/perforce-cf-templates/releases/33e4c88e555cf40c7b0851d22b02def4.template
-        response = client.describe_images(
-            Filters=[
-                {
-                    "Name": "name",
-                    "Values": [
-                        "Perforce-Swarm-SDP-AMI-Base*",
-                    ],
-                }
-            ],
-        )
+        filters = [
+            {"Name": "name", "Values": [ConfigRetriever.HELIX_SWARM_AMI_NAME_PATTERN]},
+            {"Name": "architecture", "Values": ["x86_64"]},
+            {"Name": "image-type", "Values": ["machine"]},
+            {"Name": "state", "Values": ["available"]},
+        ]
+        owners = [
+            owner.strip()
+            for owner in os.environ.get(
+                ConfigRetriever.HELIX_SWARM_AMI_OWNERS_ENV_VAR,
+                ConfigRetriever.HELIX_SWARM_AMI_DEFAULT_OWNERS,
+            ).split(",")
+            if owner.strip()
+        ]
+
+        images = self._describe_images(client, filters=filters, owners=owners)
+        if not images and owners:
+            print(
+                f"WARNING: No Helix Swarm AMI owned by {owners} found in {region}, searching all owners. "
+                f"Set {ConfigRetriever.HELIX_SWARM_AMI_OWNERS_ENV_VAR} to speed this lookup up."
+            )
+            images = self._describe_images(client, filters=filters, owners=[])
 
-        if len(response["Images"]) == 0:
+        if not images:
             print(
                 f"ERROR: Could not determine latest AMI ID with name prefix 'Perforce-Swarm-SDP-AMI-BASE' for region {region}."
             )
             sys.exit(1)
 
-        # Sort Images by Creation Date to get latest image
-        amis = sorted(response["Images"], key=lambda k: k["CreationDate"], reverse=True)
+        # Pick the latest image by Creation Date
+        latest_ami = max(images, key=lambda k: k["CreationDate"])
+
+        return latest_ami["ImageId"]
+
+    def _describe_images(
+        self, client, *, filters: List[Dict[str, Any]], owners: List[str]
+    ):
+        request = {"Filters": filters, "MaxResults": 1000}
+        if owners:
+            request["Owners"] = owners
+
+        images = []
+        while True:
+            response = client.describe_images(**request)
+            images.extend(response["Images"])
+            next_token = response.get("NextToken")
+            if not next_token:
+                return images
+            request["NextToken"] = next_token
+
+    def get_instance_type_info(self, instance_type: str) -> Optional[Dict[str, Any]]:
+        """Returns the DescribeInstanceTypes entry for instance_type, or None if it's invalid"""
+        return self._resolve(
+            f"instance_type:{instance_type}",
+            lambda: self.describe_instance_type(instance_type),
+            WEEK,
+        )
+
+    def get_instance_type_infos(
+        self, instance_types: List[str]
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Returns the DescribeInstanceTypes entries for several instance types, by
+        instance type. The ones that aren't resolved or cached yet are described in a
+        single call.
+        """
+        batch = {}
+
+        def describe(instance_type: str):
+            # The first instance type to miss the cache describes all of them
+            if not batch:
+                batch.update(self.describe_instance_types(instance_types))
+            return batch.get(instance_type)
+
+        return {
+            instance_type: self._resolve(
+                f"instance_type:{instance_type}",
+                lambda instance_type=instance_type: describe(instance_type),
+                WEEK,
+            )
+            for instance_type in instance_types
+        }
+
+    def describe_instance_types(
+        self, instance_types: List[str]
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        client = get_client("ec2")
+
+        try:
+            response = client.describe_instance_types(InstanceTypes=instance_types)
+        except exceptions.ClientError as e:
+            # One invalid instance type fails the whole call, so find out which
+            if e.response["Error"]["Code"] == "InvalidInstanceType":
+                return {
+                    instance_type: self.describe_instance_type(instance_type)
+                    for instance_type in instance_types
+                }
+            raise
+
+        described = {
+            instance_type["InstanceType"]: instance_type
+            for instance_type in response["InstanceTypes"]
+        }
+        return {
+            instance_type: described.get(instance_type)
+            for instance_type in instance_types
+        }
+
+    def get_instance_type_offerings(
+        self, zone_names: List[str], instance_types: List[str]
+    ) -> Dict[str, List[str]]:
+        """Returns which of the instance types each zone offers, by zone name"""
+        return self._resolve(
+            f"instance_type_offerings:{','.join(sorted(zone_names))}:{','.join(sorted(instance_types))}",
+            lambda: self.describe_instance_type_offerings(zone_names, instance_types),
+            WEEK,
+        )
+
+    def describe_instance_type_offerings(
+        self, zone_names: List[str], instance_types: List[str]
+    ) -> Dict[str, List[str]]:
+        paginator = get_client("ec2").get_paginator("describe_instance_type_offerings")
+        offerings = {zone_name: [] for zone_name in zone_names}
+        for page in paginator.paginate(
+            LocationType="availability-zone",
+            Filters=[
+                {"Name": "location", "Values": zone_names},
+                {"Name": "instance-type", "Values": instance_types},
+            ],
+        ):
+            for offering in page["InstanceTypeOfferings"]:
+                offerings[offering["Location"]].append(offering["InstanceType"])
+        return {
+            zone_name: sorted(zone_instance_types)
+            for zone_name, zone_instance_types in offerings.items()
+        }
+
+    def describe_instance_type(self, instance_type: str) -> Optional[Dict[str, Any]]:
+        client = get_client("ec2")
 
-        return {region: amis[0]["ImageId"]}
+        try:
+            response = client.describe_instance_types(InstanceTypes=[instance_type])
+        except exceptions.ClientError as e:
+            if e.response["Error"]["Code"] == "InvalidInstanceType":
+                return None
+            raise
+
+        instance_types = response["InstanceTypes"]
+        return instance_types[0] if instance_types else None
 
     def get_license_server_security_group_id(self):
-        ec2 = boto3.client("ec2")
+        ec2 = get_client("ec2")
         group_name = self.studio_name + "Network-LicenseServers"
         response = ec2.describe_security_groups(
             Filters=[dict(Name="group-name", Values=[group_name + "*"])]
@@ -353,3 +903,30 @@ class ConfigRetriever:
 
     def get_jenkins_key_pair_name(self):
         return os.environ.get(ConfigRetriever.JENKINS_KEY_PAIR_NAME_ENV_VAR, "")
+
+
+_config_retrievers: Dict[Tuple[str, str, str], ConfigRetriever] = {}
+_config_retrievers_lock = threading.Lock()
+
+
+def get_config_retriever() -> ConfigRetriever:
+    """Returns the ConfigRetriever shared by every stack synthesized in this process.
+
+    Discovery is performed once per account/region (and therefore per studio, since
+    the studio is the first one found in that account and region), no matter how
+    many stacks or nested stacks ask for it.
+    """
+    session = get_session()
+    key = (
+        os.environ.get("CDK_DEFAULT_ACCOUNT", ""),
+        session.profile_name or "",
+        session.region_name or "",
+    )
+
+    with _config_retrievers_lock:
+        config_retriever = _config_retrievers.get(key)
+        if config_retriever is None:
+            config_retriever = ConfigRetriever()
+            _config_retrievers[key] = config_retriever
+
+    return config_retriever
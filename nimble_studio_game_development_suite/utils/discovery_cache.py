@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+
+class DiscoveryCache:
+    """
+    A cdk.context.json style file caching the results of studio discovery.
+
+    Entries are keyed by account, region and studio id, and each one carries its own
+    expiry time so that slow-moving topology (VPC, subnets, stack outputs) can be
+    reused across synths while still being refreshed periodically.
+    """
+
+    CACHE_PATH_ENV_VAR = "CDK_DISCOVERY_CACHE_PATH"
+    CACHE_MODE_ENV_VAR = "CDK_DISCOVERY_CACHE_MODE"
+
+    MODE_USE = "use"
+    MODE_REFRESH = "refresh"
+    MODE_OFF = "off"
+
+    KEY_PREFIX = "nimble-studio-discovery"
+
+    def __init__(self, path: Path, mode: str = MODE_USE):
+        if mode not in (self.MODE_USE, self.MODE_REFRESH, self.MODE_OFF):
+            raise ValueError(
+                f"Invalid discovery cache mode '{mode}', expected one of "
+                f"'{self.MODE_USE}', '{self.MODE_REFRESH}' or '{self.MODE_OFF}'"
+            )
+        self.path = Path(path)
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @classmethod
+    def from_environment(cls) -> "DiscoveryCache":
+        path = os.environ.get(cls.CACHE_PATH_ENV_VAR) or Path.home().joinpath(
+            ".cdk", "cache", "nimble-studio-discovery.json"
+        )
+        mode = os.environ.get(cls.CACHE_MODE_ENV_VAR, cls.MODE_USE).lower()
+        return cls(path, mode)
+
+    @classmethod
+    def make_key(cls, name: str, **scope: str) -> str:
+        """Builds a key such as 'nimble-studio-discovery:account=1:region=us-west-2:vpc_id'"""
+        parts = [cls.KEY_PREFIX]
+        parts.extend(f"{key}={value}" for key, value in sorted(scope.items()))
+        parts.append(name)
+        return ":".join(parts)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Returns (True, value) for a live entry, and (False, None) otherwise"""
+        if self.mode != self.MODE_USE:
+            return False, None
+
+        with self._lock:
+            entry = self._load().get(key)
+
+        if not entry or entry.get("expires", 0) <= time.time():
+            return False, None
+        return True, entry["value"]
+
+    def put(self, key: str, value: Any, ttl: int) -> None:
+        if self.mode == self.MODE_OFF:
+            return
+
+        entry = {"value": value, "expires": int(time.time()) + ttl}
+        with self._lock:
+            self._load()[key] = entry
+            self._save({key: entry})
+
+    def clear(self, key_prefix: str = KEY_PREFIX) -> int:
+        """Removes every entry whose key starts with key_prefix, returning how many were removed"""
+        with self._lock:
+            entries = self._read()
+            removed = [key for key in entries if key.startswith(key_prefix)]
+            for key in removed:
+                del entries[key]
+            self._write(entries)
+            self._entries = entries
+        return len(removed)
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._load())
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    def _save(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        # Other apps may be synthesizing at the same time, so merge our updates
+        # into whatever is on disk right now rather than overwriting it
+        entries = self._read()
+        entries.update(updates)
+        now = time.time()
+        entries = {
+            key: entry
+            for key, entry in entries.items()
+            if entry.get("expires", 0) > now
+        }
+        self._write(entries)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r") as cache_file:
+                entries = json.load(cache_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.name}."
+        )
+        with os.fdopen(file_descriptor, "w") as temp_file:
+            json.dump(entries, temp_file, indent=2, sort_keys=True, default=str)
+        os.replace(temp_path, self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.discovery_cache",
+        description="Inspect, clear or refresh the Nimble Studio discovery cache.",
+    )
+    parser.add_argument(
+        "command",
+        choices=["show", "clear", "refresh"],
+        help="'show' prints the cache, 'clear' empties it and 'refresh' re-runs discovery for the current account and region",
+    )
+    args = parser.parse_args()
+
+    discovery_cache = DiscoveryCache.from_environment()
+
+    if args.command == "show":
+        print(json.dumps(discovery_cache.entries(), indent=2, sort_keys=True))
+    elif args.command == "clear":
+        removed = discovery_cache.clear()
+        print(f"Removed {removed} entries from {discovery_cache.path}")
+    else:
+        from utils.config_retriever import ConfigRetriever
+
+        config_retriever = ConfigRetriever(
+            discovery_cache=DiscoveryCache(
+                discovery_cache.path, DiscoveryCache.MODE_REFRESH
+            )
+        )
+        config_retriever.refresh_discovery_cache()
+        print(f"Refreshed discovery cache in {discovery_cache.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import atexit
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+class DiscoverySnapshot:
+    """
+    Records every discovery result of a synth to a versioned JSON file, and replays it.
+
+    In replay mode no discovery call reaches AWS, and the CDK context recorded
+    alongside the results (e.g. the Vpc.from_lookup results in cdk.context.json) is
+    fed back into the App, along with the account and region the snapshot was
+    recorded in, so templates can be synthesized fully offline.
+    """
+
+    SNAPSHOT_MODE_ENV_VAR = "CDK_DISCOVERY_SNAPSHOT_MODE"
+    SNAPSHOT_PATH_ENV_VAR = "CDK_DISCOVERY_SNAPSHOT_PATH"
+
+    MODE_RECORD = "record"
+    MODE_REPLAY = "replay"
+
+    VERSION = 2
+    CDK_CONTEXT_FILE = "cdk.context.json"
+
+    # The stacks' environment, which context lookups are keyed by
+    ENVIRONMENT_VARIABLES = ("CDK_DEFAULT_ACCOUNT", "CDK_DEFAULT_REGION")
+
+    _instances: Dict[Path, "DiscoverySnapshot"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: Path, mode: str):
+        if mode not in (self.MODE_RECORD, self.MODE_REPLAY):
+            raise ValueError(
+                f"Invalid discovery snapshot mode '{mode}', expected "
+                f"'{self.MODE_RECORD}' or '{self.MODE_REPLAY}'"
+            )
+        self.path = Path(path)
+        self.mode = mode
+        # The CDK CLI runs the app from its directory, where cdk.context.json lives.
+        # Resolve it now, as save() runs at exit, when the working directory may have
+        # changed
+        self.context_path = Path(self.CDK_CONTEXT_FILE).absolute()
+        self._lock = threading.Lock()
+        self._discovery: Dict[str, Any] = {}
+        self._context: Dict[str, Any] = {}
+        self._environment: Dict[str, str] = {}
+
+        if self.replaying:
+            self._load()
+        else:
+            self._environment = {
+                name: os.environ[name]
+                for name in self.ENVIRONMENT_VARIABLES
+                if name in os.environ
+            }
+            atexit.register(self.save)
+
+    @classmethod
+    def from_environment(cls) -> Optional["DiscoverySnapshot"]:
+        """Returns the process' snapshot, or None when snapshots are not enabled"""
+        mode = os.environ.get(cls.SNAPSHOT_MODE_ENV_VAR, "").lower()
+        if not mode:
+            return None
+
+        path = Path(
+            os.environ.get(cls.SNAPSHOT_PATH_ENV_VAR, "discovery-snapshot.json")
+        ).absolute()
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path, mode)
+            return cls._instances[path]
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == self.MODE_REPLAY
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == self.MODE_RECORD
+
+    @property
+    def context(self) -> Dict[str, Any]:
+        return dict(self._context)
+
+    @property
+    def environment(self) -> Dict[str, str]:
+        return dict(self._environment)
+
+    def apply_environment(self) -> None:
+        """Synthesizes the stacks for the recorded account and region"""
+        for name in self.ENVIRONMENT_VARIABLES:
+            if name in self._environment:
+                os.environ[name] = self._environment[name]
+            else:
+                os.environ.pop(name, None)
+
+    def replay(self, name: str) -> Any:
+        with self._lock:
+            if name not in self._discovery:
+                raise KeyError(
+                    f"'{name}' was not recorded in discovery snapshot {self.path}. "
+                    f"Re-record it with {self.SNAPSHOT_MODE_ENV_VAR}={self.MODE_RECORD}."
+                )
+            return self._discovery[name]
+
+    def record(self, name: str, value: Any) -> None:
+        with self._lock:
+            self._discovery[name] = value
+
+    def save(self) -> None:
+        # Context lookups (such as Vpc.from_lookup) are performed by the CDK CLI and
+        # stored in cdk.context.json, so we capture them from there
+        if self.context_path.exists():
+            with open(self.context_path, "r") as context_file:
+                self._context.update(json.load(context_file))
+
+        with self._lock:
+            snapshot = {
+                "version": self.VERSION,
+                "discovery": self._discovery,
+                "context": self._context,
+                "environment": self._environment,
+            }
+            with open(self.path, "w") as snapshot_file:
+                json.dump(
+                    snapshot, snapshot_file, indent=2, sort_keys=True, default=str
+                )
+
+    def _load(self) -> None:
+        with open(self.path, "r") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+
+        if snapshot.get("version") != self.VERSION:
+            raise ValueError(
+                f"Discovery snapshot {self.path} has version {snapshot.get('version')}, "
+                f"expected {self.VERSION}. Please re-record it."
+            )
+        self._discovery = snapshot.get("discovery", {})
+        self._context = snapshot.get("context", {})
+        self._environment = snapshot.get("environment", {})
+
+
+def snapshot_context() -> Dict[str, Any]:
+    """
+    Returns the CDK context to replay into the App, if a snapshot is being replayed.
+
+    The recorded CDK_DEFAULT_ACCOUNT and CDK_DEFAULT_REGION are also set, so this must
+    be called before the stacks' environment is read.
+    """
+    snapshot = DiscoverySnapshot.from_environment()
+    if snapshot and snapshot.replaying:
+        snapshot.apply_environment()
+        return snapshot.context
+    return {}
@@ -0,0 +1,81 @@
+import re
+from typing import List
+
+from aws_cdk import Names, Tags, aws_ec2 as ec2, aws_ssm as ssm
+from constructs import Construct
+
+CONFIGURATION_TAG_KEY = "NimbleStudioConfiguration"
+
+# User data wrappers which have no meaning inside an SSM document
+USER_DATA_TAGS_PATTERN = re.compile(r"</?powershell>|<persist>\s*true\s*</persist>")
+
+
+class SsmConfiguration(Construct):
+    """
+    Applies a configuration script to instances through a State Manager association.
+
+    The script is stored in an SSM Command document rather than in the instances'
+    user data, so editing it replaces the document and re-runs the association on the
+    running instances, instead of stopping or replacing them. Instances are targeted
+    by tag rather than by id, so the association doesn't wait for an instance to be
+    created and the script can send the instance's CloudFormation creation signal.
+
+    The script may run more than once on the same instance, so it must be idempotent.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        *,
+        script: str,
+        instances: List[ec2.Instance],
+        platform: ec2.OperatingSystemType = ec2.OperatingSystemType.LINUX,
+        description: str = None,
+        timeout_seconds: int = 3600,
+    ):
+        super().__init__(scope, construct_id)
+
+        if platform == ec2.OperatingSystemType.WINDOWS:
+            action = "aws:runPowerShellScript"
+        else:
+            action = "aws:runShellScript"
+
+        run_command = USER_DATA_TAGS_PATTERN.sub("", script).strip().splitlines()
+
+        self.document = ssm.CfnDocument(
+            self,
+            "Document",
+            document_type="Command",
+            content={
+                "schemaVersion": "2.2",
+                "description": description or f"Configures {construct_id}",
+                "mainSteps": [
+                    {
+                        "action": action,
+                        "name": "Configure",
+                        "inputs": {
+                            "runCommand": run_command,
+                            "timeoutSeconds": str(timeout_seconds),
+                        },
+                    }
+                ],
+            },
+        )
+
+        self.target_tag_value = Names.unique_id(self)
+        for instance in instances:
+            Tags.of(instance).add(CONFIGURATION_TAG_KEY, self.target_tag_value)
+
+        self.association = ssm.CfnAssociation(
+            self,
+            "Association",
+            name=self.document.ref,
+            targets=[
+                ssm.CfnAssociation.TargetProperty(
+                    key=f"tag:{CONFIGURATION_TAG_KEY}",
+                    values=[self.target_tag_value],
+                )
+            ],
+            max_concurrency="1",
+        )
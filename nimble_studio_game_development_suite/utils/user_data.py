@@ -0,0 +1,119 @@
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict
+
+from aws_cdk import aws_ec2 as ec2, aws_iam as iam
+from aws_cdk.aws_s3_assets import Asset
+from constructs import Construct
+
+USER_DATA_OFFLOAD_THRESHOLD_ENV_VAR = "CDK_USER_DATA_OFFLOAD_THRESHOLD"
+
+# EC2 rejects user data larger than 16 KB, so we offload well before that
+DEFAULT_USER_DATA_OFFLOAD_THRESHOLD = 12 * 1024
+
+# Tokens are only resolved at deploy time, so we assume each one renders to at most
+# the length of a stack name; the ARNs and ids we substitute are all shorter
+TOKEN_SIZE_ALLOWANCE = 128
+
+
+class UserDataTemplate:
+    """
+    A user data script containing placeholders such as STACK_NAME_PLACEHOLDER.
+
+    The script is read once per process, and rendered in a single pass over its text.
+    Rendering fails if any *_PLACEHOLDER token is left without a value.
+    """
+
+    PLACEHOLDER_PATTERN = re.compile(r"\b[A-Z][A-Z0-9_]*_PLACEHOLDER\b")
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "r") as template_file:
+            self.text = template_file.read()
+        self.placeholders = frozenset(self.PLACEHOLDER_PATTERN.findall(self.text))
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def load(cls, path: Path) -> "UserDataTemplate":
+        return cls(path)
+
+    def render(self, replacement_map: Dict[str, str]) -> str:
+        unresolved = self.placeholders.difference(replacement_map)
+        if unresolved:
+            raise ValueError(
+                f"No value for {', '.join(sorted(unresolved))} in user data template {self.path.name}"
+            )
+        if not replacement_map:
+            return self.text
+
+        pattern = self._compile_pattern(tuple(replacement_map))
+        return pattern.sub(lambda match: replacement_map[match.group(0)], self.text)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _compile_pattern(keys) -> re.Pattern:
+        # Longest keys first, so that a key is never shadowed by one of its prefixes
+        return re.compile(
+            "|".join(re.escape(key) for key in sorted(keys, key=len, reverse=True))
+        )
+
+
+def estimate_user_data_size(user_data: str) -> int:
+    return len(user_data.encode("utf-8")) + (
+        user_data.count("${Token[") * TOKEN_SIZE_ALLOWANCE
+    )
+
+
+def get_user_data_offload_threshold() -> int:
+    return int(
+        os.environ.get(
+            USER_DATA_OFFLOAD_THRESHOLD_ENV_VAR, DEFAULT_USER_DATA_OFFLOAD_THRESHOLD
+        )
+    )
+
+
+def add_user_data_from_template(
+    scope: Construct,
+    id: str,
+    *,
+    user_data: ec2.UserData,
+    template_path: Path,
+    replacement_map: Dict[str, str],
+    role: iam.IRole,
+) -> None:
+    """
+    Renders a Linux user data script into user_data.
+
+    Small scripts are inlined. Once a script nears the EC2 user data limit, the
+    template is uploaded as an S3 asset instead, and user_data only downloads it,
+    substitutes the placeholders on the instance and runs it.
+    """
+    template = UserDataTemplate.load(Path(template_path))
+    rendered = template.render(replacement_map)
+
+    if estimate_user_data_size(rendered) <= get_user_data_offload_threshold():
+        user_data.add_commands(rendered)
+        return
+
+    asset = Asset(scope, f"{id}Template", path=str(template.path))
+    asset.grant_read(role)
+
+    local_path = user_data.add_s3_download_command(
+        bucket=asset.bucket, bucket_key=asset.s3_object_key
+    )
+    user_data.add_commands(
+        *[
+            f"sed -i -e 's|{_escape_sed(key)}|{_escape_sed(value)}|g' {local_path}"
+            for key, value in replacement_map.items()
+        ]
+    )
+    user_data.add_execute_file_command(file_path=local_path)
+
+
+def _escape_sed(value: str) -> str:
+    # Only the static parts of a value can be escaped here; the ARNs, ids and names
+    # that tokens resolve to at deploy time contain none of these characters
+    value = value.replace("\\", "\\\\").replace("|", "\\|").replace("&", "\\&")
+    return value.replace("'", "'\\''")
@@ -46,9 +46,3 @@ def create_ssm_policy(scope: Construct, ssm_log_bucket: s3.IBucket):
             ]
         ),
     )
-
-def replace_user_data_values(user_data: str, replacement_map: dict) -> str:
-    """Replaces userdata with a map of replacement_map.key -> replacement_map.value"""
-    for key, value in replacement_map.items():
-        user_data = user_data.replace(key, value)
-    return user_data